@@ -1,75 +1,158 @@
 from __future__ import annotations
 
 import argparse
+import array
+import inspect
+import json
+import mmap
+import os
+import pickle
+import queue
 import random
-from collections.abc import Callable
-from functools import lru_cache
+import struct
+import tempfile
+import threading
+import time
+import warnings
+from collections.abc import Callable, Generator, Iterator
+from functools import lru_cache, partial, wraps
 from importlib.metadata import entry_points
-from itertools import groupby
+from importlib.util import find_spec
+from pathlib import Path
 from types import ModuleType
-from typing import Any, TypeVar
+from typing import TYPE_CHECKING, Any, TypeVar
 from zlib import crc32
 
-from _pytest.config import Config
+from _pytest.config import Config, PytestPluginManager
 from _pytest.config.argparsing import Parser
 from _pytest.fixtures import SubRequest
+from _pytest.main import Session
 from _pytest.nodes import Item
-from pytest import Collector, fixture, hookimpl
-
-# factory-boy
-try:
+from _pytest.python import Function, Metafunc
+from _pytest.reports import TestReport
+from _pytest.runner import CallInfo
+from _pytest.terminal import TerminalReporter
+from pytest import (
+    Collector,
+    File,
+    PytestWarning,
+    StashKey,
+    UsageError,
+    fixture,
+    hookimpl,
+)
+
+from pytest_randomly._plan import OrderEntry, _crc32, _plan_order, window_type
+
+if TYPE_CHECKING:
+    from factory.random import get_random_state as factory_get_random_state
     from factory.random import set_random_state as factory_set_random_state
+    from faker.generator import random as faker_random
+    from model_bakery.random_gen import baker_random
+    from numpy import random as np_random
+
+# Random generators of optional dependencies, imported on first use by
+# _import_generators(), as some are slow to import: factory_boy imports Django
+# when it is installed.
+have_factory_boy = False
+have_faker = False
+have_model_bakery = False
+have_numpy = False
+
+
+@lru_cache
+def _import_generators() -> None:
+    global have_factory_boy, factory_get_random_state, factory_set_random_state
+    global have_faker, faker_random
+    global have_model_bakery, baker_random
+    global have_numpy, np_random
 
-    have_factory_boy = True
-except ImportError:  # pragma: no cover
-    # old versions
+    # factory-boy
     try:
-        from factory.fuzzy import set_random_state as factory_set_random_state
+        from factory.random import get_random_state as factory_get_random_state
+        from factory.random import set_random_state as factory_set_random_state
 
         have_factory_boy = True
-    except ImportError:
-        have_factory_boy = False
+    except ImportError:  # pragma: no cover
+        # old versions
+        try:
+            from factory.fuzzy import (  # type: ignore [attr-defined, no-redef]
+                get_random_state as factory_get_random_state,
+            )
+            from factory.fuzzy import set_random_state as factory_set_random_state
 
-# faker
-try:
-    from faker.generator import random as faker_random
+            have_factory_boy = True
+        except ImportError:
+            have_factory_boy = False
 
-    have_faker = True
-except ImportError:  # pragma: no cover
-    have_faker = False
+    # faker
+    try:
+        from faker.generator import random as faker_random
 
-# model_bakery
-try:
-    from model_bakery.random_gen import baker_random
+        have_faker = True
+    except ImportError:  # pragma: no cover
+        have_faker = False
 
-    have_model_bakery = True
-except ImportError:  # pragma: no cover
-    have_model_bakery = False
+    # model_bakery
+    try:
+        from model_bakery.random_gen import baker_random
 
-# numpy
-try:
-    from numpy import random as np_random
+        have_model_bakery = True
+    except ImportError:  # pragma: no cover
+        have_model_bakery = False
+
+    # numpy
+    try:
+        from numpy import random as np_random
 
-    have_numpy = True
-except ImportError:  # pragma: no cover
-    have_numpy = False
+        have_numpy = True
+    except ImportError:  # pragma: no cover
+        have_numpy = False
 
 
 def make_seed() -> int:
     return random.Random().getrandbits(32)
 
 
+def repeat_type(string: str) -> int:
+    try:
+        count = int(string)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"{repr(string)} is not a positive integer")
+    return count
+
+
+def rate_type(string: str) -> float:
+    try:
+        rate = float(string)
+    except ValueError:
+        rate = -1.0
+    if not 0.0 <= rate <= 1.0:
+        raise argparse.ArgumentTypeError(
+            f"{repr(string)} is not a number between 0 and 1"
+        )
+    return rate
+
+
 def seed_type(string: str) -> str | int:
-    if string in ("default", "last"):
+    if string in ("default", "last", "plan"):
         return string
     try:
         return int(string)
     except ValueError:
         raise argparse.ArgumentTypeError(
-            f"{repr(string)} is not an integer or the string 'last'"
+            f"{repr(string)} is not an integer or the string 'last' or 'plan'"
         )
 
 
+def pytest_addhooks(pluginmanager: PytestPluginManager) -> None:
+    from pytest_randomly import hooks
+
+    pluginmanager.add_hookspecs(hooks)
+
+
 def pytest_addoption(parser: Parser) -> None:
     group = parser.getgroup("randomly", "pytest-randomly")
     group._addoption(
@@ -79,7 +162,9 @@ def pytest_addoption(parser: Parser) -> None:
         default="default",
         type=seed_type,
         help="""Set the seed that pytest-randomly uses (int), or pass the
-                special value 'last' to reuse the seed from the previous run.
+                special value 'last' to reuse the seed from the previous run,
+                or 'plan' to pick a seed that runs the most pairs of tests
+                next to each other that previous 'plan' runs did not.
                 Default behaviour: use random.Random().getrandbits(32), so the seed is
                 different on each run.""",
     )
@@ -99,25 +184,204 @@ def pytest_addoption(parser: Parser) -> None:
         default=True,
         help="Stop pytest-randomly from randomly reorganizing the test order.",
     )
+    group._addoption(
+        "--randomly-restore",
+        action="store",
+        dest="randomly_restore",
+        default=None,
+        metavar="NODEID",
+        help="""Run only the given test, restoring the random states it had
+                when it last failed with --randomly-dont-reset-seed.""",
+    )
+    group._addoption(
+        "--randomly-isolated",
+        action="store_true",
+        dest="randomly_isolated",
+        default=False,
+        help="""Skip resetting the global random generators for tests that
+                use the randomly_rng or randomly_numpy_rng fixtures.""",
+    )
+    group._addoption(
+        "--randomly-window",
+        action="store",
+        dest="randomly_window",
+        default=0,
+        type=window_type,
+        help="""Limit the shuffle so each module moves at most this many
+                module positions, and each class or test at most this many
+                positions within its group, preserving some locality.
+                Default: 0, for an unlimited shuffle.""",
+    )
+    group._addoption(
+        "--randomly-repeat",
+        action="store",
+        dest="randomly_repeat",
+        default=1,
+        type=repeat_type,
+        help="""Run each test function the given number of times, with a
+                different derived seed each time. The repeats are shuffled
+                along with all other tests.""",
+    )
+    group._addoption(
+        "--randomly-confirm-dependencies",
+        action="store_true",
+        dest="randomly_confirm_dependencies",
+        default=False,
+        help="""Schedule each test that previously failed after another test
+                directly after that suspected polluter, to confirm or refute
+                the order dependency in fewer runs.""",
+    )
+    group._addoption(
+        "--randomly-dist",
+        action="store_true",
+        dest="randomly_dist",
+        default=False,
+        help="""With pytest-xdist, hand out tests in pytest-randomly's
+                shuffled order, in whole module/class groups, with work
+                stealing. The sequence each worker ran is saved in the cache
+                under randomly/xdist_schedule.""",
+    )
+    group._addoption(
+        "--randomly-seed-processes",
+        action="store_true",
+        dest="randomly_seed_processes",
+        default=False,
+        help=f"""Export each derived seed in the {PROCESS_SEED_ENV_VAR}
+                environment variable, so child processes can reseed with
+                pytest_randomly.reseed_process().""",
+    )
+    group._addoption(
+        "--randomly-fixture-cache-size",
+        action="store",
+        dest="randomly_fixture_cache_size",
+        default=512,
+        type=int,
+        help="""Maximum size in megabytes of the on-disk cache for fixtures
+                decorated with @pytest_randomly.cache_fixture. The least
+                recently used entries are removed beyond this. Default: 512.""",
+    )
+    group._addoption(
+        "--randomly-data-size",
+        action="store",
+        dest="randomly_data_size",
+        default=16,
+        type=int,
+        help="""Size in megabytes of the pool of random data shared by the
+                randomly_data fixture. Default: 16.""",
+    )
+    group._addoption(
+        "--randomly-prefetch",
+        action="store",
+        dest="randomly_prefetch",
+        default=0,
+        type=window_type,
+        help="""Compute the random states for the next N tests in a
+                background thread, so resetting the seed before each test
+                only has to restore them. Default: 0, which disables it.""",
+    )
+    group._addoption(
+        "--randomly-pollution-rate",
+        action="store",
+        dest="randomly_pollution_rate",
+        default=0.0,
+        type=rate_type,
+        help="""Check this fraction of tests, picked by the seed, for
+                changing the state of random generators they don't declare
+                with @pytest.mark.randomly_uses, and report them at the end
+                of the run. Default: 0, which disables the check.""",
+    )
+    group._addoption(
+        "--randomly-events",
+        action="store",
+        dest="randomly_events",
+        default=None,
+        metavar="PATH",
+        help="""Append a JSON line per test to PATH as tests run, with its
+                position in the order, the seeds of its phases, and the time
+                spent resetting random generators.""",
+    )
+    group._addoption(
+        "--randomly-history",
+        action="store_true",
+        dest="randomly_history",
+        default=False,
+        help="""Append the seed, order, and each test's duration and outcome
+                to a run history in the cache, and report tests that have both
+                passed and failed across recorded runs.""",
+    )
 
 
 def pytest_configure(config: Config) -> None:
+    config.addinivalue_line(
+        "markers",
+        "randomly_group(name): keep the tests in the named group next to each"
+        + " other in pytest-randomly's shuffled order.",
+    )
+    config.addinivalue_line(
+        "markers",
+        "randomly_spread(resource): avoid running tests that use the named"
+        + " resource next to each other in pytest-randomly's shuffled order.",
+    )
+    config.addinivalue_line(
+        "markers",
+        "randomly_uses(*generators): declare the random generators that the"
+        + " test draws from, out of "
+        + ", ".join(repr(name) for name in POLLUTION_GENERATORS)
+        + ", for --randomly-pollution-rate.",
+    )
+
     if config.pluginmanager.hasplugin("xdist"):
         config.pluginmanager.register(XdistHooks())
 
+    if config.getoption("randomly_restore") is not None:
+        restore_states = _get_failure_states(config)
+        if restore_states is None:
+            raise UsageError(
+                "No random states saved for "
+                + f"{config.getoption('randomly_restore')}, it must have failed"
+                + " in a previous run with --randomly-dont-reset-seed."
+            )
+        config.stash[restore_states_key] = restore_states
+        config.option.randomly_reset_seed = False
+
+    if config.getoption("randomly_prefetch") and config.getoption(
+        "randomly_reset_seed"
+    ):
+        config.pluginmanager.register(StatePrefetcher(config))
+
     seed_value = config.getoption("randomly_seed")
+    if hasattr(config, "workerinput"):  # pragma: no cover
+        # pytest-xdist: use seed determined on main, which also records it.
+        config.option.randomly_seed = config.workerinput["randomly_seed"]
+        return
+
+    if config.getoption("randomly_history"):
+        assert hasattr(config, "cache"), (
+            "The cacheprovider plugin is required to use --randomly-history"
+        )
+        config.pluginmanager.register(RunHistory(config))
+
+    if config.getoption("randomly_pollution_rate"):
+        config.pluginmanager.register(PollutionSummary())
+
+    events_path = config.getoption("randomly_events")
+    if events_path is not None:
+        config.pluginmanager.register(EventLog(Path(events_path)))
+
     if seed_value == "last":
         assert hasattr(config, "cache"), (
             "The cacheprovider plugin is required to use 'last'"
         )
         assert config.cache is not None
         seed = config.cache.get("randomly_seed", make_seed())
+    elif seed_value == "plan":
+        assert hasattr(config, "cache"), (
+            "The cacheprovider plugin is required to use 'plan'"
+        )
+        seed = _plan_seed(config)
+        config.stash[seed_planned_key] = True
     elif seed_value == "default":
-        if hasattr(config, "workerinput"):  # pragma: no cover
-            # pytest-xdist: use seed generated on main.
-            seed = config.workerinput["randomly_seed"]
-        else:
-            seed = make_seed()
+        seed = make_seed()
     else:
         seed = seed_value
     if hasattr(config, "cache"):
@@ -126,6 +390,11 @@ def pytest_configure(config: Config) -> None:
     config.option.randomly_seed = seed
 
 
+def pytest_unconfigure(config: Config) -> None:
+    if config.getoption("randomly_seed_processes"):
+        os.environ.pop(PROCESS_SEED_ENV_VAR, None)
+
+
 class XdistHooks:
     # Hooks for xdist only, registered when needed in pytest_configure()
     # https://docs.pytest.org/en/latest/writing_plugins.html#optionally-using-hooks-from-3rd-party-plugins  # noqa: E501
@@ -134,16 +403,69 @@ class XdistHooks:
         seed = node.config.getoption("randomly_seed")
         node.workerinput["randomly_seed"] = seed  # type: ignore [attr-defined]
 
+    @hookimpl(tryfirst=True)
+    def pytest_xdist_make_scheduler(self, config: Config, log: Any) -> Any:
+        if not config.getoption("randomly_dist"):
+            return None
+
+        try:
+            from pytest_randomly._xdist import RandomlyScheduling
+        except ImportError as exc:
+            raise UsageError(
+                f"--randomly-dist requires pytest-xdist 3.2 or later: {exc}"
+            ) from exc
+
+        return RandomlyScheduling(config, log)
+
+    def pytest_xdist_node_collection_finished(self, node: Item, ids: list[str]) -> None:
+        node.config.stash.setdefault(order_key, ids)
+
+    def pytest_testnodedown(self, node: Item, error: object | None) -> None:
+        workeroutput = getattr(node, "workeroutput", {})
+        if "randomly_collection" in workeroutput:
+            node.config.stash[collection_key] = [
+                tuple(entry) for entry in workeroutput["randomly_collection"]
+            ]
+        _get_observations(node.config).extend(
+            tuple(observation)
+            for observation in workeroutput.get("randomly_observations", [])
+        )
+
 
 entrypoint_reseeds: list[Callable[[int], None]] | None = None
 
 
-def _reseed(config: Config, offset: int = 0) -> int:
-    global entrypoint_reseeds
+current_seed_key = StashKey[int]()
+
+
+def _reseed(
+    config: Config, offset: int = 0, item: Item | None = None, phase: str = "session"
+) -> int:
+    start = time.perf_counter_ns()
     seed: int = config.getoption("randomly_seed") + offset
+    prefetcher = config.stash.get(prefetcher_key, None)
+    _seed_generators(seed, None if prefetcher is None else prefetcher.take(seed))
+    config.hook.pytest_randomly_reseed(config=config, item=item, phase=phase, seed=seed)
+    config.stash[current_seed_key] = seed
+    if config.getoption("randomly_seed_processes"):
+        os.environ[PROCESS_SEED_ENV_VAR] = str(seed)
+    if item is not None and config.getoption("randomly_events") is not None:
+        event = item.stash.setdefault(event_key, {"seeds": {}, "reseed_ns": 0})
+        event["seeds"][phase] = seed
+        event["reseed_ns"] += time.perf_counter_ns() - start
+    return seed
 
-    random.seed(seed)
-    random_state = random.getstate()
+
+def _seed_generators(seed: int, random_state: Any = None) -> None:
+    global entrypoint_reseeds
+
+    _import_generators()
+
+    if random_state is None:
+        random.seed(seed)
+        random_state = random.getstate()
+    else:
+        random.setstate(random_state)
 
     if have_factory_boy:  # pragma: no branch
         factory_set_random_state(random_state)
@@ -163,7 +485,19 @@ def _reseed(config: Config, offset: int = 0) -> int:
     for reseed in entrypoint_reseeds:
         reseed(seed)
 
-    return seed
+
+PROCESS_SEED_ENV_VAR = "PYTEST_RANDOMLY_PROCESS_SEED"
+
+
+def reseed_process() -> None:
+    """
+    Reseed the random generators in a child process with the seed of the test
+    phase that started it, when run with --randomly-seed-processes. Use as
+    the initializer for multiprocessing pools and process pool executors.
+    """
+    seed = os.environ.get(PROCESS_SEED_ENV_VAR)
+    if seed is not None:
+        _seed_generators(int(seed))
 
 
 def pytest_report_header(config: Config) -> str:
@@ -172,75 +506,876 @@ def pytest_report_header(config: Config) -> str:
     return f"Using --randomly-seed={seed}"
 
 
+# Fixtures that make a test use its own generators under --randomly-isolated.
+isolated_fixtures = frozenset(("randomly_rng", "randomly_numpy_rng"))
+
+
+def _resets_seed(item: Item) -> bool:
+    config = item.config
+    if not config.getoption("randomly_reset_seed"):
+        return False
+    return not (
+        config.getoption("randomly_isolated")
+        and not isolated_fixtures.isdisjoint(getattr(item, "fixturenames", ()))
+    )
+
+
+prefetcher_key = StashKey["StatePrefetcher"]()
+
+
+class StatePrefetcher:
+    """
+    Hooks for --randomly-prefetch, registered in pytest_configure().
+
+    Once the order is final, a background thread seeds a private generator
+    with the seeds of the next few tests' phases and keeps the resulting
+    states, so _reseed() can call setstate() instead of random.seed(). The
+    thread stays at most --randomly-prefetch tests ahead of the current one.
+    numpy keeps being seeded directly, as its set_state() is slower than
+    seeding.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.depth: int = config.getoption("randomly_prefetch")
+        self.seeds: list[tuple[int, ...]] = []
+        self.positions: dict[str, int] = {}
+        self.states: dict[int, Any] = {}
+        self.position = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread: threading.Thread | None = None
+        config.stash[prefetcher_key] = self
+
+    @hookimpl(trylast=True)
+    def pytest_collection_finish(self, session: Session) -> None:
+        seed = self.config.getoption("randomly_seed")
+        for position, item in enumerate(session.items):
+            crc = _crc32(item.nodeid)
+            self.seeds.append(
+                tuple(seed + offset % 2**32 for offset in (crc - 1, crc, crc + 1))
+            )
+            self.positions.setdefault(item.nodeid, position)
+        self.thread = threading.Thread(
+            target=self.run, name="pytest-randomly-prefetch", daemon=True
+        )
+        self.thread.start()
+
+    def pytest_runtest_logstart(self, nodeid: str) -> None:
+        position = self.positions.get(nodeid)
+        if position is None:
+            return
+        with self.condition:
+            self.position = position
+            # Drop states for tests that were skipped over, such as those
+            # that pytest-xdist ran on other workers.
+            upcoming = {
+                seed
+                for seeds in self.seeds[position : position + self.depth]
+                for seed in seeds
+            }
+            for seed in self.states.keys() - upcoming:
+                del self.states[seed]
+            self.condition.notify()
+
+    def pytest_sessionfinish(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def take(self, seed: int) -> Any:
+        with self.condition:
+            return self.states.pop(seed, None)
+
+    def run(self) -> None:
+        generator = random.Random()
+        index = 0
+        while True:
+            with self.condition:
+                while not self.stopped and (
+                    index >= min(len(self.seeds), self.position + self.depth)
+                ):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                index = max(index, self.position)
+                seeds = self.seeds[index]
+            states = {}
+            for seed in seeds:
+                generator.seed(seed)
+                states[seed] = generator.getstate()
+            with self.condition:
+                if index >= self.position:
+                    self.states.update(states)
+            index += 1
+
+
 def pytest_runtest_setup(item: Item) -> None:
-    if item.config.getoption("randomly_reset_seed"):
-        _reseed(item.config, (_crc32(item.nodeid) - 1) % 2**32)
+    if _resets_seed(item):
+        _reseed(item.config, (_crc32(item.nodeid) - 1) % 2**32, item, "setup")
+    elif item.nodeid == item.config.getoption("randomly_restore"):
+        _set_random_states(item.config.stash[restore_states_key])
+    elif not item.config.getoption("randomly_reset_seed"):
+        item.stash[setup_states_key] = _get_random_states()
 
 
 def pytest_runtest_call(item: Item) -> None:
-    if item.config.getoption("randomly_reset_seed"):
-        _reseed(item.config, _crc32(item.nodeid))
+    if _resets_seed(item):
+        _reseed(item.config, _crc32(item.nodeid), item, "call")
+    if _checks_pollution(item):
+        item.stash[fingerprints_key] = _fingerprints()
 
 
 def pytest_runtest_teardown(item: Item) -> None:
-    if item.config.getoption("randomly_reset_seed"):
-        _reseed(item.config, (_crc32(item.nodeid) + 1) % 2**32)
+    if fingerprints_key in item.stash:
+        before = item.stash[fingerprints_key]
+        after = _fingerprints()
+        declared = item.stash.get(declared_generators_key, set())
+        undeclared = [
+            name
+            for name in before
+            if before[name] != after[name] and name not in declared
+        ]
+        if undeclared:
+            item.stash[polluted_key] = undeclared
+    if _resets_seed(item):
+        _reseed(item.config, (_crc32(item.nodeid) + 1) % 2**32, item, "teardown")
+
+
+@hookimpl(trylast=True)
+def pytest_generate_tests(metafunc: Metafunc) -> None:
+    count = metafunc.config.getoption("randomly_repeat")
+    if count > 1:
+        if "randomly_repeat_index" not in metafunc.fixturenames:
+            metafunc.fixturenames.append("randomly_repeat_index")
+        metafunc.parametrize(
+            "randomly_repeat_index",
+            range(count),
+            indirect=True,
+            ids=lambda index: f"randomly-repeat-{index}",
+        )
 
 
-@hookimpl(tryfirst=True)
-def pytest_collection_modifyitems(config: Config, items: list[Item]) -> None:
-    if not config.getoption("randomly_reorganize"):
+@fixture
+def randomly_repeat_index(request: SubRequest) -> int:
+    index: int = getattr(request, "param", 0)
+    return index
+
+
+@hookimpl(wrapper=True)
+def pytest_runtest_makereport(
+    item: Item, call: CallInfo[None]
+) -> Generator[None, TestReport, TestReport]:
+    report = yield
+    config = item.config
+    if report.when == "call" or (report.when == "setup" and report.failed):
+        previous = config.stash.get(previous_nodeid_key, None)
+        if not report.skipped:
+            _observe(config, previous, item.nodeid, report.failed)
+        if report.failed:
+            _report_known_dependencies(config, report, previous)
+    elif report.when == "teardown":
+        config.stash[previous_nodeid_key] = item.nodeid
+
+    if report.when == "teardown" and polluted_key in item.stash:
+        # An attribute, so pytest-xdist sends it to main with the report.
+        report.randomly_polluted = item.stash[polluted_key]  # type: ignore [attr-defined]
+
+    if report.when == "teardown" and config.getoption("randomly_events") is not None:
+        report.randomly_event = _make_event(item)  # type: ignore [attr-defined]
+
+    if setup_states_key in item.stash:
+        if report.failed:
+            _get_failure_snapshots(config)[item.nodeid] = item.stash[setup_states_key]
+        elif report.when == "teardown":
+            # Passed, so any saved states are stale.
+            _get_failure_snapshots(config).setdefault(item.nodeid, None)
+    return report
+
+
+def pytest_sessionfinish(session: Session) -> None:
+    config = session.config
+    failure_snapshots = _get_failure_snapshots(config)
+    if failure_snapshots and hasattr(config, "cache"):
+        # Saved from each pytest-xdist worker, as states hold NumPy arrays.
+        _save_failure_states(config, failure_snapshots)
+
+    observations = _get_observations(config)
+    if hasattr(config, "workerinput"):  # pragma: no cover
+        # pytest-xdist: send observations to main, which records them.
+        config.workeroutput["randomly_observations"] = observations  # type: ignore [attr-defined]
+        if collection_key in config.stash:
+            config.workeroutput["randomly_collection"] = config.stash[collection_key]  # type: ignore [attr-defined]
         return
 
-    seed = _reseed(config)
+    if not hasattr(config, "cache"):
+        return
 
-    modules_items: list[tuple[ModuleType | None, list[Item]]] = []
-    for module, group in groupby(items, _get_module):
-        modules_items.append(
-            (
-                module,
-                _shuffle_by_class(list(group), seed),
-            )
+    if observations:
+        _record_observations(config, observations)
+
+    if collection_key in config.stash:
+        config.cache.set("randomly/collection", config.stash[collection_key])
+        config.cache.set("randomly/window", config.getoption("randomly_window"))
+
+    if config.stash.get(seed_planned_key, False):
+        _record_pairs(config, _order_pairs(config.stash.get(order_key, [])))
+
+    xdist_schedule = config.stash.get(xdist_schedule_key, None)
+    if xdist_schedule is not None:
+        assert config.cache is not None
+        config.cache.set(
+            "randomly/xdist_schedule",
+            {"seed": config.getoption("randomly_seed"), "workers": xdist_schedule},
+        )
+
+
+def pytest_collection_finish(session: Session) -> None:
+    if session.items:
+        session.config.stash[order_key] = [item.nodeid for item in session.items]
+
+
+class RunHistory:
+    # Hooks for --randomly-history, registered on main in pytest_configure().
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        # Per-test duration and outcome for the current run.
+        self.results: dict[str, tuple[float, int]] = {}
+
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        outcome = HISTORY_OUTCOMES.get(report.outcome)
+        if outcome is None:
+            # Outcomes from other plugins, such as pytest-rerunfailures' rerun.
+            return
+        duration = report.duration
+        previous = self.results.get(report.nodeid)
+        if previous is not None:
+            duration += previous[0]
+            outcome = max(outcome, previous[1])
+        self.results[report.nodeid] = (duration, outcome)
+
+    def pytest_sessionfinish(self) -> None:
+        seed = self.config.getoption("randomly_seed") % 2**64
+        order_hash = _order_hash(self.config.stash.get(order_key, []))
+        records = b"".join(
+            HISTORY_RECORD.pack(seed, order_hash, _crc32(nodeid), *result)
+            for nodeid, result in self.results.items()
         )
+        _append_history(_history_path(self.config), records)
 
-    def _module_key(module_item: tuple[ModuleType | None, list[Item]]) -> int:
-        module, _items = module_item
-        if module is None:
-            return _crc32(f"{seed}::None")
-        return _crc32(f"{seed}::{module.__name__}")
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        stats = _flake_stats(
+            _history_path(self.config),
+            {_crc32(nodeid) for nodeid in self.results},
+        )
+        lines = []
+        for nodeid in self.results:
+            runs, failures, seeds = stats.get(_crc32(nodeid), (0, 0, 0))
+            if 0 < failures < runs:
+                lines.append(
+                    f"{nodeid}: failed {failures} of {runs} runs,"
+                    + f" across {seeds} seeds"
+                )
+        if lines:
+            terminalreporter.write_sep("=", "pytest-randomly flaky tests")
+            for line in lines:
+                terminalreporter.write_line(line)
+
+
+# Random state pollution checks, for --randomly-pollution-rate. Fingerprints
+# are taken after the call phase's reset and again at teardown, and tests that
+# changed generators they don't declare with randomly_uses are reported.
+POLLUTION_GENERATORS = ("random", "numpy", "faker")
+fingerprints_key = StashKey[dict[str, tuple[Any, ...]]]()
+declared_generators_key = StashKey[set[str]]()
+polluted_key = StashKey[list[str]]()
+
+
+def _checks_pollution(item: Item) -> bool:
+    rate: float = item.config.getoption("randomly_pollution_rate")
+    if not rate:
+        return False
+    seed = item.config.getoption("randomly_seed")
+    return _crc32(f"{seed}::pollution::{item.nodeid}") < rate * 2**32
+
+
+def _declared_generators(item: Item) -> set[str]:
+    declared = set()
+    for marker in item.iter_markers("randomly_uses"):
+        for name in marker.args:
+            if name not in POLLUTION_GENERATORS:
+                raise UsageError(
+                    f"{item.nodeid}: unknown generator {name!r} in"
+                    + " @pytest.mark.randomly_uses, expected one of "
+                    + ", ".join(repr(name) for name in POLLUTION_GENERATORS)
+                )
+            declared.add(name)
+    return declared
+
+
+def _fingerprints() -> dict[str, tuple[Any, ...]]:
+    """
+    Cheaply identify the states of the global random generators, by their
+    position in the Mersenne Twister key and a few words of it. Drawing moves
+    the position, and every 624 draws, or reseeding, changes the words.
+    """
+    _import_generators()
+    fingerprints = {"random": _random_fingerprint(random.getstate())}
+    if have_numpy:  # pragma: no branch
+        state = np_random.get_state(legacy=True)
+        # The global RandomState always uses MT19937, with a legacy tuple state.
+        assert isinstance(state, tuple)
+        _name, key, position, has_gauss, gauss = state
+        fingerprints["numpy"] = (
+            position,
+            int(key[0]),
+            int(key[position - 1]),
+            has_gauss,
+            gauss,
+        )
+    if have_faker:  # pragma: no branch
+        fingerprints["faker"] = _random_fingerprint(faker_random.getstate())
+    return fingerprints
+
+
+def _random_fingerprint(state: tuple[Any, ...]) -> tuple[Any, ...]:
+    _version, internal, gauss = state
+    return (internal[-1], internal[0], internal[-2], gauss)
+
+
+class PollutionSummary:
+    # Hooks for --randomly-pollution-rate, registered on main in
+    # pytest_configure().
+
+    def __init__(self) -> None:
+        self.polluted: dict[str, list[str]] = {}
+
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        polluted = getattr(report, "randomly_polluted", None)
+        if polluted:
+            self.polluted[report.nodeid] = polluted
+
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if self.polluted:
+            terminalreporter.write_sep("=", "pytest-randomly random state pollution")
+            for nodeid, names in self.polluted.items():
+                terminalreporter.write_line(
+                    f"{nodeid}: changed {', '.join(names)}, which it does not"
+                    + " declare with @pytest.mark.randomly_uses"
+                )
+
+
+# Per-test events for --randomly-events. Workers attach them to teardown
+# reports, and main writes them from a thread, through a bounded queue.
+event_key = StashKey[dict[str, Any]]()
+positions_key = StashKey[dict[str, int]]()
+EVENTS_QUEUE_SIZE = 1024
+
+
+def _make_event(item: Item) -> dict[str, Any]:
+    config = item.config
+    if positions_key not in config.stash:
+        order: list[str] = config.stash.get(order_key, [])
+        config.stash[positions_key] = {
+            nodeid: position for position, nodeid in enumerate(order)
+        }
+    event = item.stash.get(event_key, {"seeds": {}, "reseed_ns": 0})
+    return {
+        "nodeid": item.nodeid,
+        "position": config.stash[positions_key].get(item.nodeid),
+        "seed": config.getoption("randomly_seed"),
+        "seeds": event["seeds"],
+        "reseed_ns": event["reseed_ns"],
+        "worker": getattr(config, "workerinput", {}).get("workerid"),
+    }
+
+
+class EventLog:
+    # Hooks for --randomly-events, registered on main in pytest_configure().
+
+    def __init__(self, path: Path) -> None:
+        self.queue: queue.Queue[dict[str, Any] | None] = queue.Queue(EVENTS_QUEUE_SIZE)
+        # Line buffered, so each event is flushed as it is written.
+        self.file = path.open("a", buffering=1)
+        self.thread = threading.Thread(
+            target=self.write, name="pytest-randomly-events", daemon=True
+        )
+        self.thread.start()
 
-    modules_items.sort(key=_module_key)
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        event = getattr(report, "randomly_event", None)
+        if event is not None:
+            self.queue.put(event)
 
-    items[:] = reduce_list_of_lists([subitems for module, subitems in modules_items])
+    def pytest_unconfigure(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
 
+    def write(self) -> None:
+        while (event := self.queue.get()) is not None:
+            self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
 
-def _get_module(item: Item) -> ModuleType | None:
+
+# Run history, appended to a binary file in the cache directory. Each record
+# is fixed-width: seed, order hash, nodeid CRC32, duration, and outcome.
+HISTORY_RECORD = struct.Struct("<QIIfB3x")
+HISTORY_OUTCOMES = {"passed": 0, "skipped": 1, "failed": 2}
+HISTORY_MAX_RECORDS = 2**20
+
+
+def _order_hash(nodeids: list[str]) -> int:
+    return crc32("\n".join(nodeids).encode())
+
+
+def _history_path(config: Config) -> Path:
+    assert config.cache is not None
+    return config.cache.mkdir("randomly") / "history.bin"
+
+
+def _read_history(path: Path) -> Iterator[tuple[int, int, int, float, int]]:
+    """
+    Yield the records in the history, unpacked straight from a memory map, so
+    the file is never loaded whole.
+    """
     try:
-        return getattr(item, "module", None)
-    except (ImportError, Collector.CollectError):
+        with (
+            path.open("rb") as fp,
+            mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            memoryview(mapped) as view,
+        ):
+            # Ignore any partial record from an interrupted write.
+            end = len(view) - len(view) % HISTORY_RECORD.size
+            with view[:end] as records:
+                yield from HISTORY_RECORD.iter_unpack(records)
+    except (FileNotFoundError, ValueError):
+        # Missing or empty file.
+        return
+
+
+def _flake_stats(path: Path, nodeid_crcs: set[int]) -> dict[int, tuple[int, int, int]]:
+    """
+    Map each of the given nodeid CRC32s in the history to its number of runs,
+    failures, and distinct seeds.
+    """
+    runs: dict[int, int] = {}
+    failures: dict[int, int] = {}
+    seeds: dict[int, set[int]] = {}
+    for seed, _order_hash, nodeid_crc, _duration, outcome in _read_history(path):
+        if nodeid_crc not in nodeid_crcs:
+            continue
+        runs[nodeid_crc] = runs.get(nodeid_crc, 0) + 1
+        if outcome == HISTORY_OUTCOMES["failed"]:
+            failures[nodeid_crc] = failures.get(nodeid_crc, 0) + 1
+        seeds.setdefault(nodeid_crc, set()).add(seed)
+    return {
+        nodeid_crc: (count, failures.get(nodeid_crc, 0), len(seeds[nodeid_crc]))
+        for nodeid_crc, count in runs.items()
+    }
+
+
+def _append_history(path: Path, records: bytes) -> None:
+    with path.open("ab") as appender:
+        appender.write(records)
+        size = appender.tell()
+    count = size // HISTORY_RECORD.size
+    if count > HISTORY_MAX_RECORDS:
+        # Drop the oldest records, down to half the cap, so the file is only
+        # rewritten once every so many runs.
+        keep = HISTORY_MAX_RECORDS // 2
+        with path.open("rb") as fp:
+            fp.seek((count - keep) * HISTORY_RECORD.size)
+            kept = fp.read(keep * HISTORY_RECORD.size)
+        _write_atomic(path, lambda fp: fp.write(kept))
+
+
+# Final order of nodeids, and the collection it was shuffled from.
+order_key = StashKey[list[str]]()
+collection_key = StashKey[list[OrderEntry]]()
+
+# Seed planning, which tracks the ordered pairs of tests that previous planned
+# runs ran next to each other, or with one test between them.
+seed_planned_key = StashKey[bool]()
+PLAN_CANDIDATES = 16
+PLAN_DISTANCES = (1, 2)
+PLAN_MAX_PAIRS = 2**20
+
+
+def _plan_seed(config: Config) -> int:
+    """
+    Pick the candidate seed whose order covers the most new pairs of tests,
+    based on the collection from the last run.
+    """
+    assert config.cache is not None
+    candidates = [make_seed() for _ in range(PLAN_CANDIDATES)]
+    entries = [tuple(entry) for entry in config.cache.get("randomly/collection", [])]
+    if not entries:
+        return candidates[0]
+
+    covered = set(_read_pairs(config))
+    window = config.getoption("randomly_window")
+
+    def _new_pairs(seed: int) -> int:
+        order = _plan_order(entries, seed, window)
+        return len(_order_pairs([entries[i][0] for i in order]) - covered)
+
+    return max(candidates, key=_new_pairs)
+
+
+def _order_pairs(nodeids: list[str]) -> set[int]:
+    crcs = [crc32(nodeid.encode()) for nodeid in nodeids]
+    return {
+        first << 32 | second
+        for distance in PLAN_DISTANCES
+        for first, second in zip(crcs, crcs[distance:])
+    }
+
+
+def _pairs_path(config: Config) -> Path:
+    assert config.cache is not None
+    return config.cache.mkdir("randomly") / "pairs.bin"
+
+
+def _read_pairs(config: Config) -> array.array[int]:
+    pairs = array.array("Q")
+    try:
+        pairs.frombytes(_pairs_path(config).read_bytes())
+    except FileNotFoundError:
+        pass
+    return pairs
+
+
+def _record_pairs(config: Config, new_pairs: set[int]) -> None:
+    pairs = _read_pairs(config)
+    pairs.extend(sorted(new_pairs.difference(pairs)))
+    # Keep the most recent pairs.
+    _pairs_path(config).write_bytes(pairs[-PLAN_MAX_PAIRS:].tobytes())
+
+
+# Random states at the start of setup, saved for failing tests under
+# --randomly-dont-reset-seed, so --randomly-restore can rerun them alone. The
+# snapshots map nodeids to states, or None for tests that passed, whose saved
+# states are removed. Each test's states are pickled to their own file in the
+# cache, and only the most recently saved are kept.
+setup_states_key = StashKey[dict[str, Any]]()
+failure_snapshots_key = StashKey[dict[str, dict[str, Any] | None]]()
+restore_states_key = StashKey[dict[str, Any]]()
+FAILURE_STATES_MAX = 100
+
+
+def _get_failure_snapshots(config: Config) -> dict[str, dict[str, Any] | None]:
+    return config.stash.setdefault(failure_snapshots_key, {})
+
+
+def _failure_states_path(config: Config, nodeid: str) -> Path:
+    assert config.cache is not None
+    directory = config.cache.mkdir("randomly-failure-states")
+    return directory / f"{_crc32(nodeid):08x}.pickle"
+
+
+def _get_failure_states(config: Config) -> dict[str, Any] | None:
+    nodeid = config.getoption("randomly_restore")
+    if not hasattr(config, "cache"):
         return None
+    try:
+        with _failure_states_path(config, nodeid).open("rb") as fp:
+            saved_nodeid, packed = pickle.load(fp)
+    except Exception:
+        # Missing, or unreadable.
+        return None
+    if saved_nodeid != nodeid:
+        return None
+    return _unpack_states(packed)
 
 
-def _shuffle_by_class(items: list[Item], seed: int) -> list[Item]:
-    klasses_items: list[tuple[type[Any] | None, list[Item]]] = []
+def _save_failure_states(
+    config: Config, snapshots: dict[str, dict[str, Any] | None]
+) -> None:
+    for nodeid, states in snapshots.items():
+        path = _failure_states_path(config, nodeid)
+        if states is None:
+            path.unlink(missing_ok=True)
+        else:
+            entry = (nodeid, _pack_states(states))
+            _write_atomic(path, partial(pickle.dump, entry))
+
+    paths = []
+    for path in _failure_states_path(config, "").parent.glob("*.pickle"):
+        try:
+            paths.append((path.stat().st_mtime, path))
+        except FileNotFoundError:  # pragma: no cover
+            continue
+    paths.sort(reverse=True)
+    for _mtime, path in paths[FAILURE_STATES_MAX:]:
+        path.unlink(missing_ok=True)
+
+
+def _pack_states(states: dict[str, Any]) -> dict[str, Any]:
+    # Mersenne Twister keys, as arrays of 32-bit words rather than tuples of
+    # ints. NumPy's state already holds an array.
+    packed = dict(states)
+    for name in ("random", "factory_boy", "faker", "model_bakery"):
+        if name in packed:
+            version, internal_state, gauss_next = packed[name]
+            packed[name] = (version, array.array("I", internal_state), gauss_next)
+    return packed
+
+
+def _unpack_states(packed: dict[str, Any]) -> dict[str, Any]:
+    states = dict(packed)
+    for name in ("random", "factory_boy", "faker", "model_bakery"):
+        if name in states:
+            version, internal_state, gauss_next = states[name]
+            states[name] = (version, tuple(internal_state), gauss_next)
+    return states
+
+
+# Sequence of nodeids each pytest-xdist worker ran, recorded by the
+# --randomly-dist scheduler.
+xdist_schedule_key = StashKey[dict[str, list[str]]]()
+
+
+# Order dependency index, stored in the cache. It maps each victim nodeid, a
+# test that has failed, to how many times it has passed and failed, and the
+# tests it failed directly after (polluters). Each polluter has the distinct
+# seeds the victim failed under after it, and how many times the victim passed
+# and failed after it. Victims and polluters are kept in the order they were
+# last seen, and the least recently seen are dropped beyond the limits below.
+DependencyIndex = dict[str, dict[str, Any]]
+Observation = tuple[str | None, str, bool]
+DEPENDENCY_MAX_VICTIMS = 1000
+DEPENDENCY_MAX_POLLUTERS = 10
+
+dependency_index_key = StashKey[DependencyIndex]()
+observations_key = StashKey[list[Observation]]()
+previous_nodeid_key = StashKey[str]()
+
+
+def _get_dependency_index(config: Config) -> DependencyIndex:
+    try:
+        return config.stash[dependency_index_key]
+    except KeyError:
+        index: DependencyIndex = {}
+        if hasattr(config, "cache"):
+            assert config.cache is not None
+            index = config.cache.get("randomly/dependencies", {})
+        config.stash[dependency_index_key] = index
+        return index
+
 
-    def _item_key(item: Item) -> int:
-        return _crc32(f"{seed}::{item.nodeid}")
+def _get_observations(config: Config) -> list[Observation]:
+    return config.stash.setdefault(observations_key, [])
 
-    for klass, group in groupby(items, _get_cls):
-        klass_items = list(group)
-        klass_items.sort(key=_item_key)
-        klasses_items.append((klass, klass_items))
 
-    def _cls_key(klass_items: tuple[type[Any] | None, list[Item]]) -> int:
-        klass, items = klass_items
-        if klass is None:
-            return _crc32(f"{seed}::None")
-        return _crc32(f"{seed}::{klass.__module__}.{klass.__qualname__}")
+def _observe(config: Config, polluter: str | None, victim: str, failed: bool) -> None:
+    # Passes are only interesting for tests that have failed before.
+    if failed or victim in _get_dependency_index(config):
+        _get_observations(config).append((polluter, victim, failed))
 
-    klasses_items.sort(key=_cls_key)
 
-    return reduce_list_of_lists([subitems for klass, subitems in klasses_items])
+def _record_observations(config: Config, observations: list[Observation]) -> None:
+    assert config.cache is not None
+    seed = config.getoption("randomly_seed")
+    index: DependencyIndex = config.cache.get("randomly/dependencies", {})
+    for polluter, victim, failed in observations:
+        if not failed and victim not in index:
+            continue
+        entry = index.pop(victim, None) or {"passed": 0, "failed": 0, "polluters": {}}
+        index[victim] = entry
+        entry["failed" if failed else "passed"] += 1
+
+        polluters = entry["polluters"]
+        if polluter is None or not (failed or polluter in polluters):
+            continue
+        stats = polluters.pop(polluter, None) or [[], 0, 0]
+        polluters[polluter] = stats
+        if failed:
+            if seed not in stats[0]:
+                stats[0].append(seed)
+            stats[2] += 1
+        else:
+            stats[1] += 1
+        for old in list(polluters)[:-DEPENDENCY_MAX_POLLUTERS]:
+            del polluters[old]
+    for old in list(index)[:-DEPENDENCY_MAX_VICTIMS]:
+        del index[old]
+    config.cache.set("randomly/dependencies", index)
+
+
+def _dependency_confidence(entry: dict[str, Any], polluter: str) -> float:
+    """
+    Estimate how likely a victim's failures are caused by running after the
+    polluter. There is no evidence until the victim has passed at least once,
+    after other tests or alone, and confidence drops with each pass after the
+    polluter and each failure after other tests.
+    """
+    if not entry["passed"]:
+        return 0.0
+    seeds, passes, failures = entry["polluters"][polluter]
+    other_failures = entry["failed"] - failures
+    result: float = len(seeds) / (len(seeds) + passes + other_failures + 1)
+    return result
+
+
+def _report_known_dependencies(
+    config: Config, report: TestReport, previous: str | None
+) -> None:
+    entry = _get_dependency_index(config).get(report.nodeid)
+    if (
+        entry is None
+        or previous is None
+        or previous not in entry["polluters"]
+        or not _dependency_confidence(entry, previous)
+    ):
+        return
+    ranked = sorted(
+        (
+            (polluter, _dependency_confidence(entry, polluter))
+            for polluter in entry["polluters"]
+        ),
+        key=lambda polluter_confidence: polluter_confidence[1],
+        reverse=True,
+    )
+    lines = ["This test has previously failed when run directly after:"]
+    for polluter, confidence in ranked:
+        if confidence:
+            seeds = entry["polluters"][polluter][0]
+            lines.append(
+                f"{polluter} (confidence {confidence:.0%},"
+                + f" seeds: {', '.join(str(seed) for seed in seeds)})"
+            )
+    report.sections.append(("pytest-randomly known dependency", "\n".join(lines)))
+
+
+@hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config: Config, items: list[Item]) -> None:
+    if config.getoption("randomly_pollution_rate"):
+        # Checked for every test up front, rather than at teardown for the
+        # sampled ones.
+        for item in items:
+            item.stash[declared_generators_key] = _declared_generators(item)
+
+    if config.getoption("randomly_reorganize"):
+        _reorganize(config, items)
+
+    if config.getoption("randomly_confirm_dependencies"):
+        _schedule_suspected_dependencies(config, items)
+
+    restore = config.getoption("randomly_restore")
+    if restore is not None:
+        deselected = [item for item in items if item.nodeid != restore]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if item.nodeid == restore]
+
+
+def _reorganize(config: Config, items: list[Item]) -> None:
+    seed = _reseed(config, phase="collection")
+
+    entries = [_order_entry(item) for item in items]
+    if getattr(config, "workerinput", {}).get("workerid", "gw0") == "gw0":
+        # Only one pytest-xdist worker needs to send its collection to main.
+        config.stash[collection_key] = entries
+        if (
+            hasattr(config, "workerinput")
+            and config.getoption("randomly_dist")
+            and getattr(config, "cache", None) is not None
+        ):
+            # Cached before the collection reaches main, so RandomlyScheduling
+            # can read the module, class, and group names of each test.
+            config.cache.set("randomly/collection", entries)
+
+    order = _plan_order(entries, seed, config.getoption("randomly_window"))
+    for message in _unsatisfied_constraints([entries[index] for index in order]):
+        warnings.warn(PytestWarning(message), stacklevel=1)
+    items[:] = [items[index] for index in order]
+
+
+def _schedule_suspected_dependencies(config: Config, items: list[Item]) -> None:
+    items_by_nodeid = {item.nodeid: item for item in items}
+    for victim, entry in _get_dependency_index(config).items():
+        candidates = [
+            polluter
+            for polluter in entry["polluters"]
+            if polluter in items_by_nodeid and _dependency_confidence(entry, polluter)
+        ]
+        if victim not in items_by_nodeid or not candidates:
+            continue
+        polluter = max(
+            candidates,
+            key=lambda candidate: _dependency_confidence(entry, candidate),
+        )
+        victim_item = items_by_nodeid[victim]
+        items.remove(victim_item)
+        items.insert(items.index(items_by_nodeid[polluter]) + 1, victim_item)
+
+
+def _get_module_name(item: Item) -> str:
+    """
+    Return the name that an item is shuffled with, as part of a module: the
+    module name for Python tests, or otherwise the nodeid of the file, or
+    collector, that the item came from, which avoids importing anything for
+    doctests and plugin items.
+    """
+    if isinstance(item, Function):
+        module = _get_module(item)
+        return "None" if module is None else module.__name__
+    parent = next(
+        (node for node in reversed(item.listchain()) if isinstance(node, File)),
+        item.parent,
+    )
+    return "None" if parent is None else parent.nodeid
+
+
+def _get_module(item: Item) -> ModuleType | None:
+    try:
+        return getattr(item, "module", None)
+    except (ImportError, Collector.CollectError):
+        return None
+
+
+def _order_entry(item: Item) -> OrderEntry:
+    klass = _get_cls(item)
+    return (
+        item.nodeid,
+        _get_module_name(item),
+        "None" if klass is None else f"{klass.__module__}.{klass.__qualname__}",
+        _marker_name(item, "randomly_group"),
+        _marker_name(item, "randomly_spread"),
+    )
+
+
+def _marker_name(item: Item, name: str) -> str:
+    marker = item.get_closest_marker(name)
+    if marker is None:
+        return ""
+    if len(marker.args) != 1 or not isinstance(marker.args[0], str):
+        raise UsageError(f"{item.nodeid}: @pytest.mark.{name} takes one name")
+    value: str = marker.args[0]
+    return value
+
+
+def _unsatisfied_constraints(ordered: list[OrderEntry]) -> list[str]:
+    """
+    Describe where the ordered entries break their randomly_spread markers.
+    Groups from randomly_group are always kept together by _constrain_order().
+    """
+    messages = []
+    clashes: dict[str, list[str]] = {}
+    for position, entry in enumerate(ordered):
+        if position and entry[4] and ordered[position - 1][4] == entry[4]:
+            clashes.setdefault(entry[4], []).append(entry[0])
+    for resource, nodeids in clashes.items():
+        messages.append(
+            f"pytest-randomly could not spread randomly_spread({resource!r}),"
+            + f" {len(nodeids)} tests run directly after another test using it,"
+            + f" starting with {nodeids[0]}."
+        )
+    return messages
 
 
 def _get_cls(item: Item) -> type[Any] | None:
@@ -250,30 +1385,333 @@ def _get_cls(item: Item) -> type[Any] | None:
 T = TypeVar("T")
 
 
-def reduce_list_of_lists(lists: list[list[T]]) -> list[T]:
-    new_list = []
-    for list_ in lists:
-        new_list.extend(list_)
-    return new_list
+def _get_random_states() -> dict[str, Any]:
+    _import_generators()
+    states: dict[str, Any] = {"random": random.getstate()}
+    if have_factory_boy:  # pragma: no branch
+        states["factory_boy"] = factory_get_random_state()  # type: ignore [no-untyped-call]
+    if have_faker:  # pragma: no branch
+        states["faker"] = faker_random.getstate()
+    if have_model_bakery:  # pragma: no branch
+        states["model_bakery"] = baker_random.getstate()
+    if have_numpy:  # pragma: no branch
+        states["numpy"] = np_random.get_state()
+    return states
+
+
+def _set_random_states(states: dict[str, Any]) -> None:
+    _import_generators()
+    random.setstate(states["random"])
+    if have_factory_boy and "factory_boy" in states:  # pragma: no branch
+        factory_set_random_state(states["factory_boy"])  # type: ignore [no-untyped-call]
+    if have_faker and "faker" in states:  # pragma: no branch
+        faker_random.setstate(states["faker"])
+    if have_model_bakery and "model_bakery" in states:  # pragma: no branch
+        baker_random.setstate(states["model_bakery"])
+    if have_numpy and "numpy" in states:  # pragma: no branch
+        np_random.set_state(states["numpy"])
+
+
+def cache_fixture(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Cache a fixture's return value on disk, keyed by the fixture's name and
+    source code, and the random seed in effect when it runs. Apply beneath
+    @pytest.fixture. NumPy arrays are stored separately and loaded
+    memory-mapped, read-only. The key doesn't cover other inputs, so only
+    fixtures without arguments, besides request, are supported.
+    """
+    if inspect.isgeneratorfunction(func):
+        raise TypeError("cache_fixture does not support yield fixtures.")
+
+    key = _crc32(f"{func.__module__}.{func.__qualname__}")
+    fingerprint = _crc32(inspect.getsource(func))
+    signature = inspect.signature(func)
+    if set(signature.parameters) - {"request"}:
+        raise TypeError(
+            "cache_fixture does not support fixtures with arguments other than"
+            + " request."
+        )
+    pass_request = "request" in signature.parameters
 
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        request: SubRequest = (
+            kwargs["request"] if pass_request else kwargs.pop("request")
+        )
+        config = request.config
+        seed = config.stash.get(current_seed_key, None)
+        # Under --randomly-isolated, tests that aren't reseeded leave the
+        # previous test's seed in place.
+        resets_seed = (
+            _resets_seed(request.node)
+            if isinstance(request.node, Item)
+            else config.getoption("randomly_reset_seed")
+        )
+        if seed is None or not resets_seed or not hasattr(config, "cache"):
+            return func(*args, **kwargs)
+
+        assert config.cache is not None
+        directory = config.cache.mkdir("randomly-fixtures")
+        path = directory / f"{func.__name__}-{key:08x}-{seed}-{fingerprint:08x}"
+        try:
+            cached: T = _load_cached_fixture(path)
+            return cached
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # Corrupt, or refers to code that has since changed.
+            _remove_cached_fixture(path)
+
+        result = func(*args, **kwargs)
+        try:
+            _save_cached_fixture(path, result)
+        except Exception as exc:
+            _remove_cached_fixture(path)
+            warnings.warn(
+                PytestWarning(
+                    f"pytest-randomly could not cache fixture {func.__name__}:"
+                    + f" {exc!r}"
+                ),
+                stacklevel=1,
+            )
+            return result
+        _evict_cached_fixtures(
+            directory, config.getoption("randomly_fixture_cache_size") * 2**20
+        )
+        return result
+
+    if not pass_request:
+        wrapper.__signature__ = signature.replace(  # type: ignore [attr-defined]
+            parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY),
+            ]
+        )
+    return wrapper
+
+
+def _load_cached_fixture(path: Path) -> Any:
+    with path.with_suffix(".pickle").open("rb") as fp:
+        entry = pickle.load(fp)
+    os.utime(path.with_suffix(".pickle"))
+    if entry["array"]:
+        from numpy import load
+
+        value = load(path.with_suffix(".npy"), mmap_mode="r")
+    else:
+        value = entry["value"]
+    # Leave the random generators as generating the value would have.
+    _set_random_states(entry["states"])
+    return value
+
+
+def _save_cached_fixture(path: Path, value: Any) -> None:
+    _import_generators()
+    array = have_numpy and type(value).__module__ == "numpy" and hasattr(value, "dtype")
+    if array:
+        from numpy import save
+
+        _write_atomic(path.with_suffix(".npy"), lambda fp: save(fp, value))
+    entry = {
+        "array": array,
+        "value": None if array else value,
+        "states": _get_random_states(),
+    }
+    _write_atomic(path.with_suffix(".pickle"), lambda fp: pickle.dump(entry, fp))
+
+
+def _remove_cached_fixture(path: Path) -> None:
+    for suffix in (".pickle", ".npy"):
+        path.with_suffix(suffix).unlink(missing_ok=True)
+
+
+def _write_atomic(path: Path, write: Callable[[Any], None]) -> None:
+    # Write to a temporary file first, so concurrent readers, such as other
+    # pytest-xdist workers, never see a partial file.
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            write(fp)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _evict_cached_fixtures(directory: Path, max_size: int) -> None:
+    entries = []
+    for path in directory.glob("*.pickle"):
+        try:
+            stat = path.stat()
+            size = stat.st_size
+            if path.with_suffix(".npy").exists():
+                size += path.with_suffix(".npy").stat().st_size
+        except FileNotFoundError:  # pragma: no cover
+            continue
+        entries.append((stat.st_mtime, size, path))
+    entries.sort(reverse=True)
+    total = 0
+    for _mtime, size, path in entries:
+        total += size
+        if total > max_size:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".npy").unlink(missing_ok=True)
+
+
+def _test_seed(config: Config, nodeid: str) -> int | None:
+    """
+    Return the seed for a test's own generators, or None if pytest-randomly
+    has been imported but disabled, so pytest_configure hasn't run to set the
+    seed.
+    """
+    seed = config.getoption("randomly_seed")
+    if seed in ("default", "last", "plan"):
+        return None
+    result: int = seed + _crc32(nodeid)
+    return result
+
+
+@fixture
+def randomly_rng(pytestconfig: Config, request: SubRequest) -> random.Random:
+    seed = _test_seed(pytestconfig, request.node.nodeid)
+    return random.Random(_crc32(request.node.nodeid) if seed is None else seed)
 
-@lru_cache
-def _crc32(string: str) -> int:
-    return crc32(string.encode())
 
+if find_spec("numpy") is not None:  # pragma: no branch
 
-if have_faker:  # pragma: no branch
+    @fixture
+    def randomly_numpy_rng(pytestconfig: Config, request: SubRequest) -> Any:
+        from numpy.random import default_rng
+
+        seed = _test_seed(pytestconfig, request.node.nodeid)
+        if seed is None:
+            seed = _crc32(request.node.nodeid)
+        # Negative seeds are valid for pytest-randomly, but not for NumPy.
+        return default_rng(seed % 2**32)
+
+
+class RandomlyData:
+    """
+    Deterministic random data for a test, read from a pool generated once per
+    seed and shared between processes.
+    """
+
+    def __init__(self, pool: memoryview, offset: int) -> None:
+        self._pool = pool
+        self._position = offset
+
+    def bytes(self, size: int) -> memoryview:
+        """
+        Return the next size random bytes, as a read-only view of the pool.
+        """
+        if size > len(self._pool):
+            raise ValueError(
+                f"Cannot read {size} bytes from a pool of {len(self._pool)}"
+                + " bytes, increase --randomly-data-size."
+            )
+        if self._position + size > len(self._pool):
+            self._position = 0
+        view = self._pool[self._position : self._position + size]
+        self._position += size
+        return view
+
+    def floats(self, size: int) -> Any:
+        """
+        Return a NumPy array of the next size random floats in [0.0, 1.0).
+        """
+        from numpy import frombuffer
+
+        words = frombuffer(self.bytes(size * 8), dtype="<u8")
+        return (words >> 11) * (1.0 / 2**53)
+
+
+data_pool_key = StashKey[memoryview]()
+# Seconds after which a pool's lock is abandoned, or an unused pool of another
+# seed is removed.
+DATA_POOL_LOCK_TIMEOUT = 60
+DATA_POOL_MAX_AGE = 24 * 60 * 60
+
+
+def _get_data_pool(config: Config) -> memoryview:
+    try:
+        return config.stash[data_pool_key]
+    except KeyError:
+        pass
+
+    seed = config.getoption("randomly_seed")
+    size = config.getoption("randomly_data_size") * 2**20
+    if hasattr(config, "cache"):
+        assert config.cache is not None
+        directory = config.cache.mkdir("randomly-data")
+        path = directory / f"{seed}-{size}.bin"
+        while True:
+            try:
+                fp = path.open("rb")
+            except FileNotFoundError:
+                _write_data_pool(path, seed, size)
+                continue
+            with fp:
+                pool = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+            # Mark the pool as in use, so other runs don't remove it.
+            os.utime(path)
+            break
+    else:
+        pool = memoryview(random.Random(seed).randbytes(size))
+    config.stash[data_pool_key] = pool
+    return pool
+
+
+def _write_data_pool(path: Path, seed: int, size: int) -> None:
+    """
+    Generate the pool at the path, unless another process, such as another
+    pytest-xdist worker, holds its lock, in which case wait for that process
+    to write it instead.
+    """
+    lock = path.with_suffix(".lock")
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        while not path.exists():
+            try:
+                age = time.time() - lock.stat().st_mtime
+            except FileNotFoundError:
+                # Released, but the pool is missing, so the writer failed.
+                break
+            if age > DATA_POOL_LOCK_TIMEOUT:
+                # Left behind by an interrupted run.
+                break
+            time.sleep(0.01)
+        else:
+            return
+
+    try:
+        data = random.Random(seed).randbytes(size)
+        _write_atomic(path, lambda fp: fp.write(data))
+    finally:
+        lock.unlink(missing_ok=True)
+
+    cutoff = time.time() - DATA_POOL_MAX_AGE
+    for other in path.parent.glob("*.bin"):
+        try:
+            if other != path and other.stat().st_mtime < cutoff:
+                other.unlink()
+        except OSError:  # pragma: no cover
+            # Removed by another process, or in use on Windows.
+            pass
+
+
+@fixture
+def randomly_data(pytestconfig: Config, request: SubRequest) -> RandomlyData:
+    pool = _get_data_pool(pytestconfig)
+    return RandomlyData(pool, _crc32(request.node.nodeid) % len(pool))
+
+
+if find_spec("faker") is not None:  # pragma: no branch
 
     @fixture(autouse=True)
     def faker_seed(pytestconfig: Config, request: SubRequest) -> Any:
         from faker.contrib.pytest.plugin import DEFAULT_SEED
 
-        seed = pytestconfig.getoption("randomly_seed")
-        if seed in ("default", "last"):
-            # pytest-randomly has been imported but disabled, so
-            # pytest_configure hasn't run to set the seed. Fall back to
-            # Faker's default seed.
-            return DEFAULT_SEED
-        else:
-            result: int = seed + _crc32(request.node.nodeid)
-            return result
+        seed = _test_seed(pytestconfig, request.node.nodeid)
+        # Without a seed, fall back to Faker's default seed.
+        return DEFAULT_SEED if seed is None else seed
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+
+from pytest_randomly._plan import _plan_order, window_type
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m pytest_randomly")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser(
+        "plan",
+        help="""Show the test order for a seed, using the tests collected in
+                the last run, without importing them.""",
+    )
+    plan_parser.add_argument(
+        "--seed",
+        type=int,
+        help="The seed to show the order for. Default: the seed of the last run.",
+    )
+    plan_parser.add_argument(
+        "--window",
+        type=window_type,
+        help="The --randomly-window to apply. Default: the window of the last run.",
+    )
+    plan_parser.add_argument(
+        "--shards",
+        type=shards_type,
+        default=1,
+        help="Split the order into this many contiguous shards. Default: 1.",
+    )
+    plan_parser.add_argument(
+        "--test",
+        metavar="NODEID",
+        help="Only show the position, and shard, of the given test.",
+    )
+    plan_parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(".pytest_cache"),
+        help="The pytest cache directory. Default: .pytest_cache.",
+    )
+    args = parser.parse_args(argv)
+    return plan(args.seed, args.window, args.shards, args.test, args.cache_dir)
+
+
+def shards_type(string: str) -> int:
+    try:
+        shards = int(string)
+    except ValueError:
+        shards = 0
+    if shards < 1:
+        raise argparse.ArgumentTypeError(f"{repr(string)} is not a positive integer")
+    return shards
+
+
+def plan(
+    seed: int | None,
+    window: int | None,
+    shards: int,
+    test: str | None,
+    cache_dir: Path,
+) -> int:
+    entries = _read_cache_value(cache_dir, "randomly/collection")
+    if seed is None:
+        seed = _read_cache_value(cache_dir, "randomly_seed")
+    if window is None:
+        window = _read_cache_value(cache_dir, "randomly/window") or 0
+    if entries is None or seed is None:
+        print(
+            f"No collected tests or seed found in {cache_dir}, run pytest first.",
+            file=sys.stderr,
+        )
+        return 1
+
+    entries = [tuple(entry) for entry in entries]
+    nodeids = [entries[index][0] for index in _plan_order(entries, seed, window)]
+    bounds = [len(nodeids) * shard // shards for shard in range(shards + 1)]
+
+    if test is not None:
+        try:
+            position = nodeids.index(test)
+        except ValueError:
+            print(f"{test} was not collected in the last run.", file=sys.stderr)
+            return 1
+        message = f"{test}: position {position + 1} of {len(nodeids)}"
+        if shards > 1:
+            shard = next(s for s in range(shards) if position < bounds[s + 1])
+            message += f", shard {shard + 1} of {shards}"
+        print(message)
+        return 0
+
+    print(f"Order for --randomly-seed={seed}:")
+    for shard in range(shards):
+        if shards > 1:
+            print(f"Shard {shard + 1} of {shards}:")
+        for nodeid in nodeids[bounds[shard] : bounds[shard + 1]]:
+            print(nodeid)
+    return 0
+
+
+def _read_cache_value(cache_dir: Path, key: str) -> Any:
+    # Matches the layout of pytest's cacheprovider.
+    try:
+        with (cache_dir / "v" / key).open() as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+# Shuffling tests from their collection entries. This module has no
+# third-party imports, so python -m pytest_randomly plan stays cheap.
+import argparse
+from collections import deque
+from collections.abc import Callable
+from functools import lru_cache
+from heapq import heappop, heappush
+from itertools import groupby
+from typing import TypeVar
+from zlib import crc32
+
+# The nodeid, module name, class name, randomly_group name, and
+# randomly_spread resource of a test item, which determine where it lands in
+# the shuffled order. Non-Python items use their file's nodeid as the module
+# name, and unmarked items have empty group and resource names.
+OrderEntry = tuple[str, str, str, str, str]
+
+
+T = TypeVar("T")
+
+
+def window_type(string: str) -> int:
+    try:
+        window = int(string)
+    except ValueError:
+        window = -1
+    if window < 0:
+        raise argparse.ArgumentTypeError(
+            f"{repr(string)} is not a non-negative integer"
+        )
+    return window
+
+
+def _plan_order(entries: list[OrderEntry], seed: int, window: int = 0) -> list[int]:
+    """
+    Return the shuffled order of the entries, as indices into them.
+    """
+    modules_indices: list[tuple[str, list[int]]] = []
+    for module, group in groupby(range(len(entries)), lambda i: entries[i][1]):
+        modules_indices.append(
+            (
+                module,
+                _plan_by_class(entries, list(group), seed, window),
+            )
+        )
+
+    def _module_key(module_indices: tuple[str, list[int]]) -> int:
+        module, _indices = module_indices
+        return _crc32(f"{seed}::{module}")
+
+    _seeded_sort(modules_indices, _module_key, window)
+
+    order = reduce_list_of_lists([indices for module, indices in modules_indices])
+    if any(entry[3] or entry[4] for entry in entries):
+        order = _constrain_order(entries, order)
+    return order
+
+
+def _constrain_order(entries: list[OrderEntry], order: list[int]) -> list[int]:
+    """
+    Apply the randomly_group and randomly_spread markers to the shuffled
+    order: move each group's tests up to where its first test landed, then
+    pull later tests or groups forward so that none sharing a resource run
+    next to each other, where possible.
+    """
+    groups: dict[str, list[int]] = {}
+    for index in order:
+        if entries[index][3]:
+            groups.setdefault(entries[index][3], []).append(index)
+
+    units: list[list[int]] = []
+    for index in order:
+        group = entries[index][3]
+        if not group:
+            units.append([index])
+        elif groups[group][0] == index:
+            units.append(groups[group])
+
+    def _resources(unit: list[int]) -> tuple[str, str]:
+        # The resources at either end of a unit are the ones that can clash.
+        return entries[unit[0]][4], entries[unit[-1]][4]
+
+    # Units pulled out of the way, queued by the resource they start with,
+    # with a heap of the position and resource at the head of each queue, so
+    # the earliest one that doesn't clash is found without a rescan.
+    deferred: dict[str, deque[tuple[int, list[int]]]] = {}
+    heads: list[tuple[int, str]] = []
+
+    def _defer(position: int, unit: list[int]) -> None:
+        resource = _resources(unit)[0]
+        queue = deferred.setdefault(resource, deque())
+        if not queue:
+            heappush(heads, (position, resource))
+        queue.append((position, unit))
+
+    def _take(resource: str) -> list[int]:
+        queue = deferred[resource]
+        _position, unit = queue.popleft()
+        if queue:
+            heappush(heads, (queue[0][0], resource))
+        else:
+            del deferred[resource]
+        return unit
+
+    spread: list[list[int]] = []
+    remaining = enumerate(units)
+    previous = ""
+    while True:
+        # Only units starting with the previous resource are ever deferred,
+        # so at most one head clashes.
+        clash = heappop(heads) if heads and heads[0][1] == previous else None
+        if heads:
+            spread.append(_take(heappop(heads)[1]))
+        else:
+            for position, unit in remaining:
+                if not previous or _resources(unit)[0] != previous:
+                    spread.append(unit)
+                    break
+                _defer(position, unit)
+            else:
+                if clash is None:
+                    if not heads:
+                        break
+                    # Units deferred in this scan all start with the previous
+                    # resource.
+                    clash = heappop(heads)
+                # Nothing can go here without a clash.
+                spread.append(_take(clash[1]))
+                clash = None
+        if clash is not None:
+            heappush(heads, clash)
+        previous = _resources(spread[-1])[1]
+
+    return reduce_list_of_lists(spread)
+
+
+def _plan_by_class(
+    entries: list[OrderEntry], indices: list[int], seed: int, window: int
+) -> list[int]:
+    klasses_indices: list[tuple[str, list[int]]] = []
+
+    def _item_key(index: int) -> int:
+        return _crc32(f"{seed}::{entries[index][0]}")
+
+    for klass, group in groupby(indices, lambda i: entries[i][2]):
+        klass_indices = list(group)
+        _seeded_sort(klass_indices, _item_key, window)
+        klasses_indices.append((klass, klass_indices))
+
+    def _cls_key(klass_indices: tuple[str, list[int]]) -> int:
+        klass, _indices = klass_indices
+        return _crc32(f"{seed}::{klass}")
+
+    _seeded_sort(klasses_indices, _cls_key, window)
+
+    return reduce_list_of_lists([indices for klass, indices in klasses_indices])
+
+
+def _seeded_sort(values: list[T], key: Callable[[T], int], window: int) -> None:
+    """
+    Sort values by their seeded key, or with a window, move each value by at
+    most that many positions.
+    """
+    if not window:
+        values.sort(key=key)
+        return
+
+    # Shuffle within consecutive blocks of window + 1 values, with the block
+    # boundaries shifted by the seeded key of the first value.
+    size = window + 1
+    start = 0
+    end = key(values[0]) % size if values else 0
+    while start < len(values):
+        values[start:end] = sorted(values[start:end], key=key)
+        start, end = end, end + size
+
+
+def reduce_list_of_lists(lists: list[list[T]]) -> list[T]:
+    new_list = []
+    for list_ in lists:
+        new_list.extend(list_)
+    return new_list
+
+
+@lru_cache
+def _crc32(string: str) -> int:
+    return crc32(string.encode())
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from typing import Any
+
+from _pytest.config import Config
+from xdist.remote import Producer  # type: ignore [import-untyped]
+from xdist.scheduler import WorkStealingScheduling  # type: ignore [import-untyped]
+
+from pytest_randomly import xdist_schedule_key
+
+# RandomlyScheduling extends xdist's private chunking, added with work
+# stealing in pytest-xdist 3.2. Fail the import if it has gone.
+if not hasattr(WorkStealingScheduling, "_send_tests"):  # pragma: no cover
+    raise ImportError("pytest-xdist's WorkStealingScheduling has no _send_tests()")
+
+
+class RandomlyScheduling(WorkStealingScheduling):  # type: ignore [misc]
+    """
+    pytest-xdist scheduler for --randomly-dist.
+
+    The collection arrives already shuffled by pytest-randomly, so tests are
+    handed out in that order, in whole module/class groups, with work stealing
+    to keep the workers balanced. The sequence each worker ran is recorded so
+    the run can be reproduced.
+    """
+
+    def __init__(self, config: Config, log: Producer | None = None) -> None:
+        super().__init__(config, log)
+        if log is None:
+            self.log = Producer("randomlysched")
+        else:
+            self.log = log.randomlysched
+        self.sequences = config.stash.setdefault(xdist_schedule_key, {})
+        # The scope of each test in the collection, once it is known.
+        self.scopes: list[tuple[str, str]] | None = None
+
+    def mark_test_complete(
+        self, node: Any, item_index: int, duration: float | None = None
+    ) -> None:
+        assert self.collection is not None
+        self.sequences.setdefault(node.gateway.id, []).append(
+            self.collection[item_index]
+        )
+        super().mark_test_complete(node, item_index, duration)
+
+    def _send_tests(self, node: Any, num: int) -> None:
+        # Round the chunk up to the end of its group, so groups are only split
+        # between workers by stealing.
+        assert self.collection is not None
+        if self.scopes is None:
+            self.scopes = _collection_scopes(self.config, self.collection)
+        if 0 < num < len(self.pending):
+            scope = self.scopes[self.pending[num - 1]]
+            while num < len(self.pending) and self.scopes[self.pending[num]] == scope:
+                num += 1
+        super()._send_tests(node, num)
+
+
+def _collection_scopes(config: Config, collection: list[str]) -> list[tuple[str, str]]:
+    """
+    Return the scope of each test in the collection: its randomly_group name,
+    or otherwise its module and class name, from the order entries that the
+    first worker cached as it shuffled the collection. Tests without an entry
+    are their own scope.
+    """
+    scopes: dict[str, tuple[str, str]] = {}
+    cache = getattr(config, "cache", None)
+    if cache is not None:
+        entries = cache.get("randomly/collection", [])
+        for nodeid, module, klass, group, _resource in entries:
+            # Module names are never empty, so groups can't clash with them.
+            scopes[nodeid] = ("", group) if group else (module, klass)
+    return [scopes.get(nodeid, (nodeid, "")) for nodeid in collection]
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from _pytest.config import Config
+from _pytest.nodes import Item
+from pytest import hookspec
+
+
+@hookspec
+def pytest_randomly_reseed(
+    config: Config, item: Item | None, phase: str, seed: int
+) -> None:
+    """
+    Called each time pytest-randomly resets the random generators, after it
+    has reset the built-in ones, to reset others to the same seed.
+
+    :param config: The pytest config object.
+    :param item: The test item being run, or None before collection.
+    :param phase: One of "session", at the start of the run, "collection",
+        before shuffling the tests, or "setup", "call", or "teardown" for the
+        test item's phases.
+    :param seed: The seed for this reset.
+    """
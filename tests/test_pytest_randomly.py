@@ -1,14 +1,27 @@
 from __future__ import annotations
 
+import json
+import os
+import random
 import shutil
+import threading
+import time
 from unittest import mock
+from zlib import crc32
 
 import pytest
 
 import pytest_randomly
+from pytest_randomly._plan import _plan_order
 
 pytest_plugins = ["pytester"]
 
+# pytest-randomly imports the random generators of optional dependencies on
+# first use. Import them here, rather than in the first in-process test run,
+# since pytester removes modules imported during a run, and numpy can't be
+# imported twice.
+pytest_randomly._import_generators()
+
 
 @pytest.fixture(autouse=True)
 def reset_entrypoints_cache():
@@ -138,7 +151,7 @@ def test_passing_nonsense_for_randomly_seed(ourtester):
         [
             (
                 "*: error: argument --randomly-seed: 'invalidvalue' "
-                + "is not an integer or the string 'last'"
+                + "is not an integer or the string 'last' or 'plan'"
             )
         ]
     )
@@ -507,7 +520,7 @@ def test_doctests_in_txt_files_reordered(ourtester):
             0
             """,
     )
-    args = ["-v", "--randomly-seed=2"]
+    args = ["-v", "--randomly-seed=1"]
 
     out = ourtester.runpytest(*args)
     out.assert_outcomes(passed=2)
@@ -517,6 +530,24 @@ def test_doctests_in_txt_files_reordered(ourtester):
     ]
 
 
+def test_doctests_grouped_by_file(ourtester):
+    doctests = "\n".join(
+        f"def f{i}():\n    '''\n    >>> 1\n    1\n    '''\n" for i in range(4)
+    )
+    ourtester.makepyfile(test_one=doctests, test_two=doctests)
+    args = ["-v", "--doctest-modules"]
+
+    for seed in range(5):
+        out = ourtester.runpytest(*args, f"--randomly-seed={seed}")
+
+        out.assert_outcomes(passed=8)
+        files = [line.split("::")[0] for line in out.outlines[9:17]]
+        assert files in (
+            ["test_one.py"] * 4 + ["test_two.py"] * 4,
+            ["test_two.py"] * 4 + ["test_one.py"] * 4,
+        )
+
+
 def test_it_runs_before_stepwise(ourtester):
     ourtester.makepyfile(
         test_one="""
@@ -645,6 +676,20 @@ def test_faker_enabled_disabled(monkeypatch, ourtester):
     out.assert_outcomes(passed=1)
 
 
+def test_enabled_disabled_seed_plan(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_one(faker, randomly_rng):
+            assert faker.name() == 'Norma Fisher'
+        """
+    )
+
+    out = ourtester.runpytest(
+        "-p", "randomly", "-p", "no:randomly", "--randomly-seed=plan"
+    )
+    out.assert_outcomes(passed=1)
+
+
 def test_model_bakery(ourtester):
     """
     Check the Model Bakery random generator is reset between tests.
@@ -796,3 +841,1290 @@ def test_xdist(n, ourtester):
 
     # Can't make any assertion on the order, since output comes back from
     # workers non-deterministically
+
+
+def test_dependency_recorded_and_reported(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        polluted = []
+
+        def test_a():
+            polluted.append(True)
+
+        def test_b():
+            assert not polluted
+        """
+    )
+    args = ["--randomly-dont-reorganize", "--randomly-seed=1"]
+
+    out = ourtester.runpytest(*args)
+    out.assert_outcomes(passed=1, failed=1)
+    assert "known dependency" not in out.stdout.str()
+    cache = pytest.Cache.for_config(ourtester.parseconfig(), _ispytest=True)
+    assert cache.get("randomly/dependencies", None) == {
+        "test_one.py::test_b": {
+            "passed": 0,
+            "failed": 1,
+            "polluters": {"test_one.py::test_a": [[1], 0, 1]},
+        }
+    }
+
+    # No evidence until test_b passes without test_a before it.
+    out = ourtester.runpytest(*args)
+    out.assert_outcomes(passed=1, failed=1)
+    assert "known dependency" not in out.stdout.str()
+
+    ourtester.runpytest(*args, "test_one.py::test_b").assert_outcomes(passed=1)
+
+    out = ourtester.runpytest(*args)
+    out.assert_outcomes(passed=1, failed=1)
+    out.stdout.fnmatch_lines(
+        [
+            "*- pytest-randomly known dependency -*",
+            "This test has previously failed when run directly after:",
+            "test_one.py::test_a (confidence 50%, seeds: 1)",
+        ]
+    )
+
+
+def test_dependency_not_reported_for_always_failing_test(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): pass
+        def test_b(): pass
+        def test_broken(): assert 0
+        def test_d(): pass
+        """
+    )
+
+    for seed in range(1, 8):
+        out = ourtester.runpytest(f"--randomly-seed={seed}")
+        out.assert_outcomes(passed=3, failed=1)
+        assert "known dependency" not in out.stdout.str()
+
+
+def test_dependency_index_is_capped(ourtester, monkeypatch):
+    monkeypatch.setattr(pytest_randomly, "DEPENDENCY_MAX_VICTIMS", 2)
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): assert 0
+        def test_b(): assert 0
+        def test_c(): assert 0
+        """
+    )
+
+    ourtester.runpytest_inprocess("--randomly-dont-reorganize", "-p", "no:xdist")
+
+    cache = pytest.Cache.for_config(ourtester.parseconfig(), _ispytest=True)
+    assert list(cache.get("randomly/dependencies", None)) == [
+        "test_one.py::test_b",
+        "test_one.py::test_c",
+    ]
+
+
+def test_dependency_confirm_schedules_victim_after_polluter(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a():
+            pass
+
+        def test_b():
+            pass
+
+        def test_c():
+            pass
+        """
+    )
+    cache = pytest.Cache.for_config(ourtester.parseconfig(), _ispytest=True)
+    cache.set(
+        "randomly/dependencies",
+        {
+            "test_one.py::test_a": {
+                "passed": 1,
+                "failed": 1,
+                "polluters": {"test_one.py::test_c": [[1], 0, 1]},
+            }
+        },
+    )
+
+    out = ourtester.runpytest(
+        "-v", "--randomly-dont-reorganize", "--randomly-confirm-dependencies"
+    )
+
+    out.assert_outcomes(passed=3)
+    assert out.outlines[9:12] == [
+        "test_one.py::test_b PASSED",
+        "test_one.py::test_c PASSED",
+        "test_one.py::test_a PASSED",
+    ]
+
+
+def test_xdist_randomly_dist(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): pass
+        def test_b(): pass
+        def test_c(): pass
+        """,
+        test_two="""
+        class TestX:
+            def test_a(self): pass
+            def test_b(self): pass
+
+        def test_c(): pass
+        """,
+    )
+
+    out = ourtester.runpytest("-n", "2", "--randomly-dist", "--randomly-seed=5")
+
+    out.assert_outcomes(passed=6)
+    cache = pytest.Cache.for_config(ourtester.parseconfig(), _ispytest=True)
+    schedule = cache.get("randomly/xdist_schedule", None)
+    assert schedule["seed"] == 5
+    sequences = schedule["workers"]
+    assert set(sequences) <= {"gw0", "gw1"}
+    assert sorted(nodeid for seq in sequences.values() for nodeid in seq) == [
+        "test_one.py::test_a",
+        "test_one.py::test_b",
+        "test_one.py::test_c",
+        "test_two.py::TestX::test_a",
+        "test_two.py::TestX::test_b",
+        "test_two.py::test_c",
+    ]
+    # Each worker ran its tests in the shuffled order.
+    entries = [tuple(entry) for entry in cache.get("randomly/collection", None)]
+    order = [entries[index][0] for index in _plan_order(entries, 5)]
+    for sequence in sequences.values():
+        assert sequence == sorted(sequence, key=order.index)
+
+
+def test_xdist_randomly_dist_keeps_groups(ourtester):
+    from pytest_randomly._xdist import RandomlyScheduling
+
+    class Node:
+        def __init__(self, gateway_id: str) -> None:
+            self.gateway = mock.Mock(id=gateway_id)
+            self.shutting_down = False
+            self.sent: list[int] = []
+
+        def send_runtest_some(self, indices: list[int]) -> None:
+            self.sent.extend(indices)
+
+    collection = [
+        # Parametrize IDs can contain "::".
+        "test_one.py::test_a[x::1]",
+        "test_one.py::test_a[x::2]",
+        "test_one.py::test_b",
+        "test_two.py::test_c",
+        "test_three.py::TestX::test_d",
+        "test_three.py::TestX::test_e",
+        "test_four.py::test_f",
+        "test_four.py::test_g",
+    ]
+    config = ourtester.parseconfigure("--tx", "2*popen")
+    config.cache.set(
+        "randomly/collection",
+        [
+            [collection[0], "test_one", "None", "", ""],
+            [collection[1], "test_one", "None", "", ""],
+            [collection[2], "test_one", "None", "", ""],
+            # A group spanning modules
+            [collection[3], "test_two", "None", "db", ""],
+            [collection[4], "test_three", "test_three.TestX", "db", ""],
+            [collection[5], "test_three", "test_three.TestX", "db", ""],
+            [collection[6], "test_four", "None", "", ""],
+            [collection[7], "test_four", "None", "", ""],
+        ],
+    )
+    scheduler = RandomlyScheduling(config)
+    nodes = [Node("gw0"), Node("gw1")]
+    for node in nodes:
+        scheduler.add_node(node)
+        scheduler.add_node_collection(node, collection)
+
+    scheduler.schedule()
+
+    # The first chunk, of four tests, is rounded up to the end of the group.
+    assert nodes[0].sent == [0, 1, 2, 3, 4, 5]
+    assert nodes[1].sent == [6, 7]
+
+
+def test_history_reports_flaky_tests(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import os
+
+        def test_a():
+            pass
+
+        def test_flaky():
+            assert os.environ.get("FLAKE") != "1"
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-history", "--randomly-seed=1")
+    out.assert_outcomes(passed=2)
+    assert "flaky tests" not in out.stdout.str()
+    history = ourtester.path / ".pytest_cache" / "d" / "randomly" / "history.bin"
+    assert history.stat().st_size == 2 * pytest_randomly.HISTORY_RECORD.size
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("FLAKE", "1")
+        out = ourtester.runpytest("--randomly-history", "--randomly-seed=2")
+    out.assert_outcomes(passed=1, failed=1)
+    out.stdout.fnmatch_lines(
+        [
+            "*= pytest-randomly flaky tests =*",
+            "test_one.py::test_flaky: failed 1 of 2 runs, across 2 seeds",
+        ]
+    )
+    assert history.stat().st_size == 4 * pytest_randomly.HISTORY_RECORD.size
+
+
+def test_history_ignores_other_outcomes(ourtester):
+    ourtester.makeconftest(
+        """
+        import pytest
+
+        @pytest.hookimpl(wrapper=True)
+        def pytest_runtest_makereport(item, call):
+            report = yield
+            if report.when == "call":
+                # Like pytest-rerunfailures
+                report.outcome = "rerun"
+            return report
+        """
+    )
+    ourtester.makepyfile(test_one="def test_a(): pass\n")
+
+    out = ourtester.runpytest("--randomly-history")
+
+    assert out.ret == 0
+    history = ourtester.path / ".pytest_cache" / "d" / "randomly" / "history.bin"
+    assert history.stat().st_size == pytest_randomly.HISTORY_RECORD.size
+
+
+def test_history_is_capped(ourtester, monkeypatch):
+    monkeypatch.setattr(pytest_randomly, "HISTORY_MAX_RECORDS", 4)
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): pass
+        def test_b(): pass
+        """
+    )
+    history = ourtester.path / ".pytest_cache" / "d" / "randomly" / "history.bin"
+
+    for seed in range(1, 4):
+        ourtester.runpytest_inprocess("--randomly-history", f"--randomly-seed={seed}")
+
+    # The third run went over the cap, keeping the two newest records.
+    records = list(pytest_randomly.HISTORY_RECORD.iter_unpack(history.read_bytes()))
+    assert [record[0] for record in records] == [3, 3]
+
+
+def test_history_not_recorded_by_default(simpletester):
+    out = simpletester.runpytest()
+    out.assert_outcomes(passed=1)
+    assert not (simpletester.path / ".pytest_cache" / "d" / "randomly").exists()
+
+
+def test_seed_processes(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import multiprocessing
+        import random
+        from concurrent.futures import ProcessPoolExecutor
+
+        import pytest_randomly
+
+
+        def draw():
+            return random.random()
+
+
+        def test_a():
+            expected = random.random()
+            with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=pytest_randomly.reseed_process,
+            ) as executor:
+                assert executor.submit(draw).result() == expected
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-seed-processes", "--randomly-seed=1")
+
+    out.assert_outcomes(passed=1)
+    assert pytest_randomly.PROCESS_SEED_ENV_VAR not in os.environ
+
+
+def test_reseed_process_without_seed(monkeypatch):
+    monkeypatch.delenv(pytest_randomly.PROCESS_SEED_ENV_VAR, raising=False)
+    state = random.getstate()
+
+    pytest_randomly.reseed_process()
+
+    assert random.getstate() == state
+
+
+def test_repeat(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+
+        import pytest
+
+        seen = set()
+
+        @pytest.mark.parametrize("x", [1, 2])
+        def test_a(x, randomly_repeat_index):
+            value = random.random()
+            assert value not in seen
+            seen.add(value)
+
+        def test_b():
+            pass
+        """
+    )
+
+    out = ourtester.runpytest("-v", "--randomly-repeat=3", "--randomly-seed=1")
+
+    out.assert_outcomes(passed=9)
+    assert sorted(out.outlines[9:18]) == [
+        "test_one.py::test_a[1-randomly-repeat-0] PASSED",
+        "test_one.py::test_a[1-randomly-repeat-1] PASSED",
+        "test_one.py::test_a[1-randomly-repeat-2] PASSED",
+        "test_one.py::test_a[2-randomly-repeat-0] PASSED",
+        "test_one.py::test_a[2-randomly-repeat-1] PASSED",
+        "test_one.py::test_a[2-randomly-repeat-2] PASSED",
+        "test_one.py::test_b[randomly-repeat-0] PASSED",
+        "test_one.py::test_b[randomly-repeat-1] PASSED",
+        "test_one.py::test_b[randomly-repeat-2] PASSED",
+    ]
+
+
+def test_repeat_index_without_repeat(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(randomly_repeat_index):
+            assert randomly_repeat_index == 0
+        """
+    )
+
+    out = ourtester.runpytest()
+
+    out.assert_outcomes(passed=1)
+
+
+def test_passing_nonsense_for_randomly_repeat(ourtester):
+    out = ourtester.runpytest("--randomly-repeat=0")
+    assert out.ret != 0
+    out.stderr.fnmatch_lines(
+        ["*: error: argument --randomly-repeat: '0' is not a positive integer"]
+    )
+
+
+def test_cache_fixture(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+
+        import numpy as np
+        import pytest
+
+        import pytest_randomly
+
+
+        @pytest.fixture
+        @pytest_randomly.cache_fixture
+        def array():
+            with open("calls.txt", "a") as fp:
+                fp.write("array\\n")
+            return np.random.rand(5)
+
+
+        @pytest.fixture
+        @pytest_randomly.cache_fixture
+        def records(request):
+            with open("calls.txt", "a") as fp:
+                fp.write("records\\n")
+            return [random.random() for _ in range(3)]
+
+
+        def test_a(array, records):
+            with open("out.txt", "a") as fp:
+                fp.write(f"{list(array)} {records} {random.random()}\\n")
+        """
+    )
+    calls = ourtester.path / "calls.txt"
+    output = ourtester.path / "out.txt"
+
+    out = ourtester.runpytest("--randomly-seed=1")
+    out.assert_outcomes(passed=1)
+    assert calls.read_text() == "array\nrecords\n"
+
+    out = ourtester.runpytest("--randomly-seed=1")
+    out.assert_outcomes(passed=1)
+    assert calls.read_text() == "array\nrecords\n"
+    first, second = output.read_text().splitlines()
+    assert first == second
+
+    out = ourtester.runpytest("--randomly-seed=2")
+    out.assert_outcomes(passed=1)
+    assert calls.read_text() == "array\nrecords\n" * 2
+
+
+def test_cache_fixture_evicts(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        import pytest_randomly
+
+
+        @pytest.fixture
+        @pytest_randomly.cache_fixture
+        def data():
+            return b"x" * 2**20
+
+
+        def test_a(data):
+            pass
+        """
+    )
+    directory = ourtester.path / ".pytest_cache" / "d" / "randomly-fixtures"
+
+    for seed in (1, 2, 3):
+        out = ourtester.runpytest(
+            f"--randomly-seed={seed}", "--randomly-fixture-cache-size=2"
+        )
+        out.assert_outcomes(passed=1)
+
+    assert len(list(directory.glob("*.pickle"))) == 1
+
+
+def test_cache_fixture_unpicklable_value(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import threading
+
+        import pytest
+
+        import pytest_randomly
+
+
+        @pytest.fixture
+        @pytest_randomly.cache_fixture
+        def lock():
+            return threading.Lock()
+
+
+        def test_a(lock):
+            with lock:
+                pass
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-seed=1")
+
+    out.assert_outcomes(passed=1, warnings=1)
+    out.stdout.fnmatch_lines(
+        ["*PytestWarning: pytest-randomly could not cache fixture lock: TypeError*"]
+    )
+    fixtures = ourtester.path / ".pytest_cache" / "d" / "randomly-fixtures"
+    assert list(fixtures.iterdir()) == []
+
+
+def test_cache_fixture_stale_entry(ourtester):
+    ourtester.makepyfile(
+        things="class Thing: pass\n",
+        helpers="""
+        from things import Thing
+
+        def make_thing():
+            with open("calls.txt", "a") as fp:
+                fp.write("thing\\n")
+            return Thing()
+        """,
+        test_one="""
+        import pytest
+
+        import pytest_randomly
+        from helpers import make_thing
+
+
+        @pytest.fixture
+        @pytest_randomly.cache_fixture
+        def thing():
+            return make_thing()
+
+
+        def test_a(thing):
+            assert type(thing).__name__ == "Thing"
+        """,
+    )
+    calls = ourtester.path / "calls.txt"
+
+    ourtester.runpytest_subprocess("--randomly-seed=1").assert_outcomes(passed=1)
+    # Move the class, leaving the fixture's source unchanged.
+    (ourtester.path / "things.py").rename(ourtester.path / "moved.py")
+    (ourtester.path / "helpers.py").write_text(
+        (ourtester.path / "helpers.py").read_text().replace("things", "moved")
+    )
+
+    out = ourtester.runpytest_subprocess("--randomly-seed=1")
+
+    out.assert_outcomes(passed=1)
+    assert calls.read_text() == "thing\nthing\n"
+    ourtester.runpytest_subprocess("--randomly-seed=1").assert_outcomes(passed=1)
+    assert calls.read_text() == "thing\nthing\n"
+
+
+def test_cache_fixture_rejects_yield_fixtures():
+    def data():
+        yield 1
+
+    with pytest.raises(TypeError, match="does not support yield fixtures"):
+        pytest_randomly.cache_fixture(data)
+
+
+def test_cache_fixture_rejects_arguments():
+    def data(tmp_path):
+        return 1
+
+    with pytest.raises(TypeError, match="arguments other than request"):
+        pytest_randomly.cache_fixture(data)
+
+
+def test_cache_fixture_skipped_when_isolated(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        import pytest_randomly
+
+
+        @pytest.fixture
+        @pytest_randomly.cache_fixture
+        def data():
+            return 1
+
+
+        def test_a():
+            pass
+
+        def test_b(data, randomly_rng):
+            pass
+        """
+    )
+
+    out = ourtester.runpytest(
+        "--randomly-isolated", "--randomly-seed=1", "--randomly-dont-reorganize"
+    )
+
+    out.assert_outcomes(passed=2)
+    fixtures = ourtester.path / ".pytest_cache" / "d" / "randomly-fixtures"
+    assert not fixtures.exists() or list(fixtures.iterdir()) == []
+
+
+def test_randomly_data(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        def test_a(randomly_data):
+            first = bytes(randomly_data.bytes(16))
+            assert len(first) == 16
+            assert bytes(randomly_data.bytes(16)) != first
+            floats = randomly_data.floats(100)
+            assert ((floats >= 0.0) & (floats < 1.0)).all()
+            with pytest.raises(ValueError, match="increase --randomly-data-size"):
+                randomly_data.bytes(2**20 + 1)
+            with open("out.txt", "a") as fp:
+                fp.write(first.hex() + "\\n")
+
+        def test_b(randomly_data):
+            with open("out.txt", "a") as fp:
+                fp.write(bytes(randomly_data.bytes(16)).hex() + "\\n")
+        """
+    )
+    output = ourtester.path / "out.txt"
+    args = ["--randomly-seed=1", "--randomly-data-size=1", "--randomly-dont-reorganize"]
+
+    out = ourtester.runpytest(*args)
+    out.assert_outcomes(passed=2)
+    out = ourtester.runpytest(*args)
+    out.assert_outcomes(passed=2)
+    out = ourtester.runpytest(*args, "-p", "no:cacheprovider")
+    out.assert_outcomes(passed=2)
+
+    lines = output.read_text().splitlines()
+    assert lines[0] != lines[1]
+    assert lines[0:2] == lines[2:4] == lines[4:6]
+
+
+def test_randomly_data_prunes_stale_pools(ourtester):
+    ourtester.makepyfile(test_one="def test_a(randomly_data): pass\n")
+    directory = ourtester.path / ".pytest_cache" / "d" / "randomly-data"
+    directory.mkdir(parents=True)
+    stale = directory / "2-1048576.bin"
+    stale.write_bytes(b"x")
+    os.utime(stale, (0, 0))
+    recent = directory / "3-1048576.bin"
+    recent.write_bytes(b"x")
+    # Left behind by an interrupted run.
+    lock = directory / "1-1048576.lock"
+    lock.touch()
+    os.utime(lock, (0, 0))
+
+    out = ourtester.runpytest("--randomly-seed=1", "--randomly-data-size=1")
+
+    out.assert_outcomes(passed=1)
+    assert sorted(path.name for path in directory.iterdir()) == [
+        "1-1048576.bin",
+        "3-1048576.bin",
+    ]
+
+
+def test_randomly_data_waits_for_lock(tmp_path):
+    path = tmp_path / "1-16.bin"
+    lock = tmp_path / "1-16.lock"
+    lock.touch()
+
+    def write() -> None:
+        path.write_bytes(b"written by another worker")
+        lock.unlink()
+
+    timer = threading.Timer(0.1, write)
+    timer.start()
+    pytest_randomly._write_data_pool(path, 1, 16)
+    timer.join()
+
+    assert path.read_bytes() == b"written by another worker"
+
+
+@pytest.mark.parametrize("window", [1, 3])
+def test_window_limits_displacement(ourtester, window):
+    names = [f"test_{i:02}" for i in range(20)]
+    ourtester.makepyfile(
+        test_one="\n".join(f"def {name}(): pass" for name in names),
+    )
+
+    out = ourtester.runpytest("-v", f"--randomly-window={window}", "--randomly-seed=1")
+
+    out.assert_outcomes(passed=20)
+    order = [line.split("::")[1].split()[0] for line in out.outlines[9:29]]
+    assert sorted(order) == names
+    assert order != names
+    assert all(abs(names.index(name) - i) <= window for i, name in enumerate(order))
+
+
+def test_window_limits_module_displacement(ourtester):
+    code = """
+        def test_it():
+            pass
+    """
+    modules = {f"test_{i}": code for i in range(8)}
+    ourtester.makepyfile(**modules)
+
+    out = ourtester.runpytest("-v", "--randomly-window=1", "--randomly-seed=1")
+
+    out.assert_outcomes(passed=8)
+    order = [line.split(".py")[0] for line in out.outlines[9:17]]
+    assert order != sorted(modules)
+    assert all(abs(int(name[5:]) - i) <= 1 for i, name in enumerate(order))
+
+
+def test_passing_nonsense_for_randomly_window(ourtester):
+    out = ourtester.runpytest("--randomly-window=-1")
+    assert out.ret != 0
+    out.stderr.fnmatch_lines(
+        ["*: error: argument --randomly-window: '-1' is not a non-negative integer"]
+    )
+
+
+def test_randomly_rng(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(randomly_rng, randomly_numpy_rng):
+            with open("out.txt", "a") as fp:
+                fp.write(f"{randomly_rng.random()} {randomly_numpy_rng.random()}\\n")
+
+        def test_b(randomly_rng):
+            with open("out.txt", "a") as fp:
+                fp.write(f"{randomly_rng.random()}\\n")
+        """
+    )
+    output = ourtester.path / "out.txt"
+    args = ["--randomly-seed=1", "--randomly-dont-reorganize"]
+
+    ourtester.runpytest(*args).assert_outcomes(passed=2)
+    ourtester.runpytest(*args).assert_outcomes(passed=2)
+
+    lines = output.read_text().splitlines()
+    assert lines[0:2] == lines[2:4]
+    assert lines[0].split()[0] != lines[1]
+
+
+def test_randomly_numpy_rng_negative_seed(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(randomly_numpy_rng):
+            randomly_numpy_rng.random()
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-seed=-5000000000")
+
+    out.assert_outcomes(passed=1)
+
+
+def test_randomly_isolated(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+        from zlib import crc32
+
+        # State left by test_a's teardown
+        teardown_seed = 1 + crc32(b"test_one.py::test_a") + 1
+        teardown_state = random.Random(teardown_seed).getstate()
+
+        def test_a():
+            pass
+
+        def test_b(randomly_rng):
+            assert random.getstate() == teardown_state
+
+        def test_c():
+            assert random.getstate() != teardown_state
+        """
+    )
+
+    out = ourtester.runpytest(
+        "--randomly-isolated", "--randomly-seed=1", "--randomly-dont-reorganize"
+    )
+
+    out.assert_outcomes(passed=3)
+
+
+def test_restore_failure_states(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+
+        import numpy as np
+
+        def test_a():
+            random.random()
+            np.random.rand()
+
+        def test_b():
+            with open("out.txt", "a") as fp:
+                fp.write(f"{random.random()} {np.random.rand()}\\n")
+            assert 0
+        """
+    )
+    output = ourtester.path / "out.txt"
+
+    out = ourtester.runpytest(
+        "--randomly-dont-reset-seed", "--randomly-dont-reorganize"
+    )
+    out.assert_outcomes(passed=1, failed=1)
+
+    out = ourtester.runpytest("--randomly-restore=test_one.py::test_b")
+    out.assert_outcomes(failed=1, deselected=1)
+
+    first, second = output.read_text().splitlines()
+    assert first == second
+
+
+def test_failure_states_removed_when_passing(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import os
+
+        def test_a():
+            assert os.environ.get("FIXED") == "1"
+        """
+    )
+    states = ourtester.path / ".pytest_cache" / "d" / "randomly-failure-states"
+
+    out = ourtester.runpytest("--randomly-dont-reset-seed")
+    out.assert_outcomes(failed=1)
+    (path,) = states.iterdir()
+    # Packed Mersenne Twister keys, rather than JSON lists of ints.
+    assert path.stat().st_size < 20_000
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("FIXED", "1")
+        out = ourtester.runpytest("--randomly-dont-reset-seed")
+    out.assert_outcomes(passed=1)
+    assert list(states.iterdir()) == []
+
+
+def test_failure_states_capped(ourtester, monkeypatch):
+    monkeypatch.setattr(pytest_randomly, "FAILURE_STATES_MAX", 2)
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): assert 0
+        def test_b(): assert 0
+        def test_c(): assert 0
+        """
+    )
+
+    out = ourtester.runpytest_inprocess("--randomly-dont-reset-seed", "-p", "no:xdist")
+
+    out.assert_outcomes(failed=3)
+    states = ourtester.path / ".pytest_cache" / "d" / "randomly-failure-states"
+    assert len(list(states.iterdir())) == 2
+
+
+def test_restore_without_failure_states(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a():
+            pass
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-restore=test_one.py::test_a")
+
+    assert out.ret != 0
+    out.stderr.fnmatch_lines(["ERROR: No random states saved for test_one.py::test_a*"])
+
+
+def test_seed_plan(ourtester, monkeypatch):
+    ourtester.makepyfile(
+        test_one="\n".join(f"def test_{i}(): pass" for i in range(10)),
+    )
+    seeds = iter([1] * pytest_randomly.PLAN_CANDIDATES + [1] * 15 + [2])
+    monkeypatch.setattr(pytest_randomly, "make_seed", lambda: next(seeds))
+    pairs = ourtester.path / ".pytest_cache" / "d" / "randomly" / "pairs.bin"
+
+    # Without a cached collection, the first candidate is used.
+    out = ourtester.runpytest_inprocess("--randomly-seed=plan")
+    out.assert_outcomes(passed=10)
+    out.stdout.fnmatch_lines(["Using --randomly-seed=1"])
+    assert pairs.stat().st_size == 8 * 17
+
+    # Seed 2 is the only candidate with new pairs.
+    out = ourtester.runpytest_inprocess("--randomly-seed=plan")
+    out.assert_outcomes(passed=10)
+    out.stdout.fnmatch_lines(["Using --randomly-seed=2"])
+    assert pairs.stat().st_size > 8 * 17
+
+
+def test_plan_order_matches_collection_order(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        class TestA:
+            def test_a(self): pass
+            def test_b(self): pass
+
+        def test_c(): pass
+        """,
+        test_two="""
+        def test_a(): pass
+        def test_b(): pass
+        """,
+    )
+
+    out = ourtester.runpytest("-v", "--randomly-seed=3")
+
+    out.assert_outcomes(passed=5)
+    cache = pytest.Cache.for_config(ourtester.parseconfig(), _ispytest=True)
+    entries = [tuple(entry) for entry in cache.get("randomly/collection", None)]
+    order = _plan_order(entries, 3)
+    assert [line.split()[0] for line in out.outlines[9:14]] == [
+        entries[index][0] for index in order
+    ]
+
+
+def test_reseed_hook(ourtester):
+    ourtester.makeconftest(
+        """
+        calls = []
+
+        def pytest_randomly_reseed(config, item, phase, seed):
+            calls.append((item.name if item else None, phase, seed))
+
+        def pytest_sessionfinish(session):
+            with open("calls.txt", "w") as fp:
+                fp.write(repr(calls))
+        """
+    )
+    ourtester.makepyfile(test_one="def test_one(): pass\n")
+
+    out = ourtester.runpytest("--randomly-seed=1")
+
+    out.assert_outcomes(passed=1)
+    assert eval((ourtester.path / "calls.txt").read_text()) == [
+        (None, "session", 1),
+        (None, "collection", 1),
+        ("test_one", "setup", 2964001072),
+        ("test_one", "call", 2964001073),
+        ("test_one", "teardown", 2964001074),
+    ]
+
+
+def test_plan_cli(ourtester, capsys):
+    from pytest_randomly.__main__ import main
+
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): pass
+        def test_b(): pass
+        def test_c(): pass
+        """
+    )
+    out = ourtester.runpytest("-v", "--randomly-seed=4")
+    out.assert_outcomes(passed=3)
+    order = [line.split()[0] for line in out.outlines[9:12]]
+    cache_dir = str(ourtester.path / ".pytest_cache")
+    capsys.readouterr()
+
+    assert main(["plan", "--cache-dir", cache_dir]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "Order for --randomly-seed=4:",
+        *order,
+    ]
+
+    assert main(["plan", "--cache-dir", cache_dir, "--seed=4", "--shards=2"]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "Order for --randomly-seed=4:",
+        "Shard 1 of 2:",
+        order[0],
+        "Shard 2 of 2:",
+        order[1],
+        order[2],
+    ]
+
+    args = ["plan", "--cache-dir", cache_dir, "--shards=2", f"--test={order[2]}"]
+    assert main(args) == 0
+    assert capsys.readouterr().out == f"{order[2]}: position 3 of 3, shard 2 of 2\n"
+
+    assert main(["plan", "--cache-dir", cache_dir, "--test=test_one.py::nope"]) == 1
+    assert capsys.readouterr().err == (
+        "test_one.py::nope was not collected in the last run.\n"
+    )
+
+
+def test_plan_cli_uses_last_window(ourtester, capsys):
+    from pytest_randomly.__main__ import main
+
+    ourtester.makepyfile(
+        **{
+            f"test_{module}": "\n".join(f"def test_{i}(): pass" for i in range(4))
+            for module in "abcd"
+        }
+    )
+    out = ourtester.runpytest("-v", "--randomly-seed=4", "--randomly-window=1")
+    out.assert_outcomes(passed=16)
+    order = [line.split()[0] for line in out.outlines[9:25]]
+    capsys.readouterr()
+
+    assert main(["plan", "--cache-dir", str(ourtester.path / ".pytest_cache")]) == 0
+    assert capsys.readouterr().out.splitlines()[1:] == order
+
+
+@pytest.mark.parametrize(
+    "arg,message",
+    [
+        ("--shards=0", "argument --shards: '0' is not a positive integer"),
+        ("--window=-1", "argument --window: '-1' is not a non-negative integer"),
+    ],
+)
+def test_plan_cli_invalid_arguments(tmp_path, capsys, arg, message):
+    from pytest_randomly.__main__ import main
+
+    with pytest.raises(SystemExit):
+        main(["plan", "--cache-dir", str(tmp_path), arg])
+    assert message in capsys.readouterr().err
+
+
+def test_plan_cli_without_cache(tmp_path, capsys):
+    from pytest_randomly.__main__ import main
+
+    assert main(["plan", "--cache-dir", str(tmp_path)]) == 1
+    assert "run pytest first" in capsys.readouterr().err
+
+
+def test_prefetch_matches_reseeding(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+
+        import pytest
+
+        @pytest.mark.parametrize("i", range(20))
+        def test_it(i):
+            with open("out.txt", "a") as fp:
+                fp.write(f"{random.random()}\\n")
+        """
+    )
+    output = ourtester.path / "out.txt"
+
+    ourtester.runpytest("--randomly-seed=1").assert_outcomes(passed=20)
+    expected = output.read_text()
+    output.unlink()
+    # take() falls back to seeding when a state isn't ready, so count the
+    # states actually used.
+    hits = []
+    take = pytest_randomly.StatePrefetcher.take
+
+    def counting_take(self: pytest_randomly.StatePrefetcher, seed: int) -> object:
+        state = take(self, seed)
+        hits.append(state is not None)
+        return state
+
+    with mock.patch.object(pytest_randomly.StatePrefetcher, "take", counting_take):
+        out = ourtester.runpytest("--randomly-seed=1", "--randomly-prefetch=4")
+
+    out.assert_outcomes(passed=20)
+    assert output.read_text() == expected
+    assert any(hits)
+
+
+def test_randomly_group_keeps_tests_together(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        @pytest.mark.randomly_group("db")
+        def test_a(): pass
+
+        def test_b(): pass
+        def test_c(): pass
+        """,
+        test_two="""
+        import pytest
+
+        def test_d(): pass
+        def test_e(): pass
+
+        @pytest.mark.randomly_group("db")
+        def test_f(): pass
+        """,
+    )
+
+    for seed in range(5):
+        out = ourtester.runpytest("-v", f"--randomly-seed={seed}")
+
+        out.assert_outcomes(passed=6)
+        nodeids = [line.split()[0] for line in out.outlines[9:15]]
+        distance = nodeids.index("test_one.py::test_a") - nodeids.index(
+            "test_two.py::test_f"
+        )
+        assert abs(distance) == 1
+
+
+def test_randomly_spread_separates_tests(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        pytestmark = pytest.mark.randomly_spread("memory")
+
+        def test_a(): pass
+        def test_b(): pass
+        def test_c(): pass
+        """,
+        test_two="""
+        def test_d(): pass
+        def test_e(): pass
+        def test_f(): pass
+        """,
+    )
+
+    out = ourtester.runpytest("-v", "--randomly-seed=1")
+
+    out.assert_outcomes(passed=6)
+    modules = [line.split("::")[0] for line in out.outlines[9:15]]
+    assert all(a != b for a, b in zip(modules, modules[1:]))
+    assert "PytestWarning" not in out.stdout.str()
+
+
+def test_randomly_spread_unsatisfiable(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        pytestmark = pytest.mark.randomly_spread("memory")
+
+        def test_a(): pass
+        def test_b(): pass
+        def test_c(): pass
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-seed=1")
+
+    out.assert_outcomes(passed=3, warnings=1)
+    out.stdout.fnmatch_lines(
+        [
+            "*PytestWarning: pytest-randomly could not spread"
+            + " randomly_spread('memory'), 2 tests run directly after another"
+            + " test using it*"
+        ]
+    )
+
+
+@pytest.mark.parametrize("every", [1, 3])
+def test_randomly_spread_scales(every):
+    # Quadratic spreading took minutes for this many tests.
+    entries = [
+        (f"test_{i // 100}.py::test_{i}", f"test_{i // 100}", "", "", "")
+        for i in range(50_000)
+    ]
+    for i in range(0, len(entries), every):
+        entries[i] = entries[i][:4] + ("memory",)
+
+    start = time.perf_counter()
+    order = _plan_order(entries, 1)
+    elapsed = time.perf_counter() - start
+
+    assert sorted(order) == list(range(len(entries)))
+    if every > 1:
+        resources = [entries[index][4] for index in order]
+        assert ("memory", "memory") not in zip(resources, resources[1:])
+    assert elapsed < 5
+
+
+def test_randomly_group_without_name(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        @pytest.mark.randomly_group
+        def test_a(): pass
+        """
+    )
+
+    out = ourtester.runpytest()
+
+    assert out.ret != 0
+    out.stderr.fnmatch_lines(
+        ["*test_one.py::test_a: @pytest.mark.randomly_group takes one name"]
+    )
+
+
+def test_pollution_rate(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+
+        import numpy as np
+        import pytest
+
+        def test_draws():
+            random.random()
+
+        def test_reseeds_numpy():
+            np.random.seed(1)
+
+        @pytest.mark.randomly_uses("random")
+        def test_declared():
+            random.random()
+
+        def test_quiet():
+            pass
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-pollution-rate=1", "-n", "2")
+
+    out.assert_outcomes(passed=4)
+    out.stdout.fnmatch_lines_random(
+        [
+            "*= pytest-randomly random state pollution =*",
+            "test_one.py::test_draws: changed random, which it does not declare"
+            + " with @pytest.mark.randomly_uses",
+            "test_one.py::test_reseeds_numpy: changed numpy, which it does not"
+            + " declare with @pytest.mark.randomly_uses",
+        ]
+    )
+    assert "test_declared" not in out.stdout.str()
+    assert "test_quiet" not in out.stdout.str()
+
+
+def test_pollution_rate_unknown_generator(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import pytest
+
+        @pytest.mark.randomly_uses("randon")
+        def test_a(): pass
+        """
+    )
+
+    # Reported at collection, even though no test is checked.
+    out = ourtester.runpytest("--randomly-pollution-rate=0.0000001")
+
+    assert out.ret != 0
+    out.stderr.fnmatch_lines(
+        [
+            "*test_one.py::test_a: unknown generator 'randon' in"
+            + " @pytest.mark.randomly_uses, expected one of*"
+        ]
+    )
+
+
+def test_pollution_rate_disabled(ourtester):
+    ourtester.makepyfile(
+        test_one="""
+        import random
+
+        def test_draws():
+            random.random()
+        """
+    )
+
+    out = ourtester.runpytest("--randomly-pollution-rate=0")
+
+    out.assert_outcomes(passed=1)
+    assert "random state pollution" not in out.stdout.str()
+
+
+def test_passing_nonsense_for_randomly_pollution_rate(ourtester):
+    ourtester.makepyfile(test_one="def test_a(): pass\n")
+
+    out = ourtester.runpytest("--randomly-pollution-rate=2")
+
+    assert out.ret != 0
+    out.stderr.fnmatch_lines(
+        [
+            "*: error: argument --randomly-pollution-rate: '2' is not a number"
+            + " between 0 and 1"
+        ]
+    )
+
+
+@pytest.mark.parametrize("n", [0, 2])
+def test_events(ourtester, n):
+    ourtester.makepyfile(
+        test_one="""
+        def test_a(): pass
+        def test_b(): pass
+        def test_c(): pass
+        """
+    )
+    events_path = ourtester.path / "events.jsonl"
+
+    out = ourtester.runpytest(
+        "-v", "--randomly-seed=1", f"--randomly-events={events_path}", "-n", str(n)
+    )
+
+    out.assert_outcomes(passed=3)
+    events = [json.loads(line) for line in events_path.read_text().splitlines()]
+    assert sorted(event["position"] for event in events) == [0, 1, 2]
+    for event in events:
+        crc = crc32(event["nodeid"].encode())
+        assert event["seed"] == 1
+        assert event["seeds"] == {
+            "setup": 1 + (crc - 1) % 2**32,
+            "call": 1 + crc,
+            "teardown": 1 + (crc + 1) % 2**32,
+        }
+        assert event["reseed_ns"] > 0
+        assert event["worker"] in ({None} if n == 0 else {"gw0", "gw1"})